@@ -1,5 +1,4 @@
 from django.apps import AppConfig
-from importlib import import_module
 from .settings import get_var
 
 
@@ -10,19 +9,135 @@ class ControlledVocabularyConfig(AppConfig):
     def ready(self):
         '''This is called by django when the project starts running.
         But before migrations (so the tables may not already exist!).
+
+        self.startup records how long this took and what happened to the
+        vocabulary records, e.g. {"duration": 0.01, "records": "unchanged"}
         '''
         import os
+        import time
+
+        start = time.perf_counter()
 
         root = get_var("DATA_ROOT")
         if not os.path.exists(root):
             os.mkdir(root)
 
-        self.write_vocabulary_records_from_managers()
+        records = self.sync_vocabulary_records(get_var("SYNC_RECORDS_ON_STARTUP"))
+
+        from django.db.models.signals import post_migrate
+
+        post_migrate.connect(
+            self._on_post_migrate,
+            sender=self,
+            dispatch_uid="controlled_vocabulary_sync_records",
+        )
+
+        self.startup = {
+            "duration": time.perf_counter() - start,
+            "records": records,
+        }
+
+    def sync_vocabulary_records(self, mode="auto"):
+        '''Loads the voc managers and writes their metadata
+        into the ControlledVocabulary records, depending on <mode>:
+            "always": always write the records
+            "auto": only if the managers or the database have changed
+                since the last time the records were written
+                (see get_records_fingerprint())
+            "never": never write the records
+        Returns what happened: "synced", "unchanged", "skipped"
+            or "not migrated" (the tables don't exist yet).
+        '''
+        ret = "skipped"
+
+        self._load_vocabulary_managers()
+
+        if mode == "always" or (
+            mode == "auto"
+            and self.get_records_fingerprint() != self._read_records_fingerprint()
+        ):
+            ret = "not migrated"
+            vocabulary_model = self._get_vocabulary_model()
+            if vocabulary_model:
+                from .models import ControlledTerm
+
+                self._write_vocabulary_records(vocabulary_model, ControlledTerm)
+                self._write_records_fingerprint()
+                ret = "synced"
+        elif mode == "auto":
+            ret = "unchanged"
+
+        return ret
+
+    def _on_post_migrate(self, using, **kwargs):
+        '''Writes the vocabulary records after the migrations,
+        as ready() may have run before the tables existed.'''
+        from django.db import DEFAULT_DB_ALIAS, connections
+        from .models import ControlledTerm, ControlledVocabulary
+
+        if using != DEFAULT_DB_ALIAS:
+            return
+
+        table = ControlledVocabulary._meta.db_table
+        if table in connections[using].introspection.table_names():
+            self._write_vocabulary_records(ControlledVocabulary, ControlledTerm)
+            self._write_records_fingerprint()
+
+    def get_records_fingerprint(self):
+        '''Returns a hash of the metadata of the loaded voc managers
+        and of the database they are written into.'''
+        import hashlib
+        import json
+        from django.db import connection
+
+        database = connection.settings_dict
+        content = [
+            [database["ENGINE"], database["NAME"], database.get("HOST", "")],
+            sorted(
+                self.vocabulary_managers.get_metadata(),
+                key=lambda metadata: metadata["prefix"],
+            ),
+        ]
+
+        return hashlib.sha256(
+            json.dumps(content, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def _read_records_fingerprint(self):
+        ret = None
+
+        try:
+            with open(self._get_records_fingerprint_path()) as fh:
+                ret = fh.read().strip()
+        except OSError:
+            pass
+
+        return ret
+
+    def _write_records_fingerprint(self):
+        import os
+
+        path = self._get_records_fingerprint_path()
+        # other processes may be writing it at the same time
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(temp_path, "w") as fh:
+                fh.write(self.get_records_fingerprint())
+            os.replace(temp_path, path)
+        except OSError:
+            # read-only data root, the records will be synced at each start
+            pass
+
+    def _get_records_fingerprint_path(self):
+        import os
+
+        return os.path.join(get_var("DATA_ROOT"), "vocabulary-records.sha256")
 
     @classmethod
     def get_vocabulary_manager(cls, prefix):
         '''Returns the vocabulary manager for the given vocabulary prefix.
         This is a unique instance (singleton).
+        Its module is imported the first time it is requested.
         '''
         from django.apps import apps
 
@@ -33,9 +148,12 @@ class ControlledVocabularyConfig(AppConfig):
         '''see _write_vocabulary_records_from_managers'''
         vocabulary_model = self._get_vocabulary_model()
         from .models import ControlledTerm
-        return self._write_vocabulary_records_from_managers(
+        ret = self._write_vocabulary_records_from_managers(
             vocabulary_model, ControlledTerm
         )
+        if ret is not None:
+            self._write_records_fingerprint()
+        return ret
 
     def write_vocabulary_records_from_managers_during_migration(
         self, migration_apps
@@ -70,65 +188,43 @@ class ControlledVocabularyConfig(AppConfig):
         or <class 'controlled_vocabulary.models.ControlledVocabulary'>
         or <class '__fake__.ControlledVocabulary'> (from django migration)
         """
-        from .models import ControlledTerm
-
         ret = self._load_vocabulary_managers()
 
         if vocabulary_model:
-            for manager in ret.values():
-                rec = {
-                    "prefix": manager.prefix,
-                    "label": manager.label,
-                    "base_url": manager.base_url,
-                    "description": manager.description,
-                    "concept": ControlledTerm._get_or_create_from_code(
-                        manager.concept, vocabulary_model, term_model
-                    ),
-                }
-
-                vocabulary_model.objects.update_or_create(
-                    prefix=rec["prefix"], defaults=rec
-                )
+            self._write_vocabulary_records(vocabulary_model, term_model)
         else:
             ret = None
 
         return ret
 
+    def _write_vocabulary_records(self, vocabulary_model, term_model):
+        """Create or update the ControlledVocabulary db records
+        with metadata from the loaded voc managers
+        (without importing their modules)."""
+        from .models import ControlledTerm
+
+        for metadata in self.vocabulary_managers.get_metadata():
+            rec = dict(metadata)
+            rec["concept"] = ControlledTerm._get_or_create_from_code(
+                metadata["concept"], vocabulary_model, term_model
+            )
+
+            vocabulary_model.objects.update_or_create(
+                prefix=rec["prefix"], defaults=rec
+            )
+
     def _load_vocabulary_managers(self):
         """
-        Reset self.vocabulary_managers as a dictionary
-        where prefix: <class>
+        Reset self.vocabulary_managers as a mapping
+        where prefix: <manager instance>
         for each manager class specified in
-        settings.CONTROLLED_VOCABULARY_VOCABULARIES
+        settings.CONTROLLED_VOCABULARY_VOCABULARIES.
+        The managers are only imported and instantiated when requested,
+        see vocabularies/registry.py.
         """
-        ret = self.vocabulary_managers = {}
-
-        module_paths = get_var("VOCABULARIES")
-
-        from .vocabularies.base import VocabularyBase as voc_base
-        import inspect
-
-        for path in module_paths:
-            try:
-                module = import_module(path)
-
-            except ImportError:
-                raise (
-                    ImportError(
-                        "{} not found (referenced from {} in your settings)".format(
-                            path, "CONTROLLED_VOCABULARY_VOCABULARIES"
-                        )
-                    )
-                )
-
-            for name in dir(module):
-                voc_class = getattr(module, name)
-                if (
-                    inspect.isclass(voc_class)
-                    and issubclass(voc_class, voc_base)
-                    and voc_class.prefix != "base"
-                ):
-                    ret[voc_class.prefix] = voc_class()
+        from .vocabularies.registry import VocabularyRegistry
+
+        ret = self.vocabulary_managers = VocabularyRegistry(get_var("VOCABULARIES"))
 
         return ret
 
@@ -0,0 +1,62 @@
+"""
+Indexes on the keys of ControlledTerm.data listed in
+settings.CONTROLLED_VOCABULARY_DATA_INDEXED_KEYS (PostgreSQL only),
+used by ControlledTerm.objects.filter_data(key=value).
+
+They are created by migration 0007, then kept in line with the setting
+by 'vocab index_data'.
+"""
+import re
+
+DATA_INDEX_PREFIX = "controlled_vocabulary_term_data_"
+
+
+def sync_data_indexes(schema_editor, table, keys):
+    """Creates the missing indexes on the <keys> of the data of the terms
+    and drops the indexes on other keys.
+    <table> is the table of ControlledTerm.
+    Returns ([created index names], [dropped index names]).
+    Does nothing on databases other than PostgreSQL.
+    """
+    created, dropped = [], []
+
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return created, dropped
+
+    quote = schema_editor.quote_name
+    names = {get_data_index_name(key): key for key in keys}
+    existing = get_data_index_names(connection, table)
+
+    for name in existing:
+        if name not in names:
+            schema_editor.execute("DROP INDEX IF EXISTS {}".format(quote(name)))
+            dropped.append(name)
+
+    for name, key in names.items():
+        if name not in existing:
+            # same expression as the one generated by data__<key>
+            schema_editor.execute(
+                "CREATE INDEX {} ON {} (({} -> {}))".format(
+                    quote(name),
+                    quote(table),
+                    quote("data"),
+                    "'{}'".format(key.replace("'", "''")),
+                )
+            )
+            created.append(name)
+
+    return created, dropped
+
+
+def get_data_index_names(connection, table):
+    """Returns the names of the existing indexes on the keys of the data."""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+
+    return [name for name in constraints if name.startswith(DATA_INDEX_PREFIX)]
+
+
+def get_data_index_name(key):
+    # e.g. controlled_vocabulary_term_data_date_of_birth
+    return (DATA_INDEX_PREFIX + re.sub(r"\W", "_", key.lower()))[:63]
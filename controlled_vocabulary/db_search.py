@@ -0,0 +1,160 @@
+"""
+Search of the terms stored in the database (ControlledTerm),
+for the vocabularies without manager (see TermListView).
+
+The backend is selected with settings.CONTROLLED_VOCABULARY_DB_SEARCH_BACKEND:
+    None: the best backend available for the database
+    or the import path of a DBSearchBackend subclass
+
+Backends:
+    DBSearchBackend: works with any database (label__icontains),
+        default on PostgreSQL, where it uses the trigram index if
+        settings.CONTROLLED_VOCABULARY_TRIGRAM_INDEX was enabled
+    SQLiteSearchBackend: uses a FTS5 trigram index (SQLite 3.34+)
+    PostgreSQLSearchBackend (opt-in): uses a tsvector index, only matches
+        the beginning of the words of the labels (e.g. 'ima' matches
+        'Still Image' but 'mage' doesn't)
+
+The indexes are created by migration 0006.
+"""
+import re
+import threading
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower
+
+from .models import ControlledTerm
+from .settings import get_var
+
+# FTS5 table of the labels, kept in sync with ControlledTerm by triggers
+SQLITE_FTS_TABLE = "controlled_vocabulary_term_fts"
+
+_db_search_backend = None
+_db_search_backend_lock = threading.Lock()
+
+
+def get_db_search_backend():
+    """Returns the DB search backend (singleton), see module docstring."""
+    global _db_search_backend
+
+    if _db_search_backend is None:
+        with _db_search_backend_lock:
+            if _db_search_backend is None:
+                path = get_var("DB_SEARCH_BACKEND")
+                if path:
+                    from django.utils.module_loading import import_string
+
+                    backend_class = import_string(path)
+                else:
+                    backend_class = _get_default_backend_class(connection.vendor)
+                _db_search_backend = backend_class()
+
+    return _db_search_backend
+
+
+def _get_default_backend_class(vendor):
+    ret = DBSearchBackend
+    if vendor == "sqlite" and _table_exists(SQLITE_FTS_TABLE):
+        ret = SQLiteSearchBackend
+    return ret
+
+
+def _table_exists(table):
+    return table in connection.introspection.table_names()
+
+
+class DBSearchBackend:
+    """Searches the terms of a vocabulary in the database.
+    Subclasses can override _get_label_condition() to use an index.
+    """
+
+    def search(self, vocabulary, pattern):
+        """Returns a queryset of the ControlledTerm of <vocabulary>
+        matching <pattern>, sorted by relevance, annotated with their score.
+
+        Same matching and scoring rules as VocabularyBaseList.search(),
+        the terms with the same score are sorted by label then termid
+        (the keys of the cursor pagination, see pagination.py).
+        All the terms of the vocabulary, sorted by label,
+        if <pattern> is empty.
+        """
+        ret = ControlledTerm.objects.filter(vocabulary=vocabulary)
+
+        pattern = pattern.strip()
+        if not pattern:
+            return ret.order_by("label", "termid")
+
+        lower_pattern = pattern.lower()
+        ret = ret.annotate(termid_lower=Lower("termid"), label_lower=Lower("label"))
+        ret = ret.filter(
+            self._get_label_condition(pattern) | Q(termid_lower=lower_pattern)
+        )
+
+        def points(condition, value):
+            return Case(
+                When(condition, then=Value(value)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+
+        ret = ret.annotate(
+            score=points(Q(label__icontains=pattern), 1)
+            + points(Q(termid_lower=lower_pattern), 4)
+            + points(Q(label__istartswith=pattern), 1)
+            + points(Q(label_lower=lower_pattern), 1)
+        )
+        # like the managers, the terms without points are not returned
+        # (e.g. selected by a full-text condition but not containing <pattern>)
+        ret = ret.filter(score__gt=0)
+
+        return ret.order_by("-score", "label", "termid")
+
+    def _get_label_condition(self, pattern):
+        """Returns a Q() selecting the terms which label contains
+        <pattern> (all the terms which label may contain it)."""
+        return Q(label__icontains=pattern)
+
+
+class SQLiteSearchBackend(DBSearchBackend):
+    """Uses a FTS5 table with a trigram tokenizer,
+    which supports patterns of three characters or more."""
+
+    def _get_label_condition(self, pattern):
+        if len(pattern) < 3:
+            return super()._get_label_condition(pattern)
+
+        return Q(
+            id__in=RawSQL(
+                "SELECT rowid FROM {} WHERE label MATCH %s".format(SQLITE_FTS_TABLE),
+                # a FTS5 string, quotes are escaped by doubling them
+                ['"{}"'.format(pattern.replace('"', '""'))],
+            )
+        )
+
+
+class PostgreSQLSearchBackend(DBSearchBackend):
+    """Uses a GIN index on to_tsvector('simple', label).
+    Selects the labels with words starting with each word of the pattern,
+    then only returns those which contain the pattern (see search()).
+
+    Not the default backend as it doesn't find the pattern in the
+    middle of words (e.g. 'mage' in 'Still Image').
+    """
+
+    def _get_label_condition(self, pattern):
+        words = re.findall(r"\w+", pattern)
+        if not words:
+            return super()._get_label_condition(pattern)
+
+        # same expression as the index
+        return Q(
+            id__in=RawSQL(
+                "SELECT id FROM {} WHERE to_tsvector('simple', label) "
+                "@@ to_tsquery('simple', %s)".format(
+                    connection.ops.quote_name(ControlledTerm._meta.db_table)
+                ),
+                [" & ".join("{}:*".format(word) for word in words)],
+            )
+        )
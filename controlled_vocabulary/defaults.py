@@ -17,3 +17,88 @@ CONTROLLED_VOCABULARY_VOCABULARIES = [
     "controlled_vocabulary.vocabularies.viaf",
     "controlled_vocabulary.vocabularies.iso15924",
 ]
+
+# Cache of the terms returned by remote vocabularies (e.g. wikidata).
+# None: in-process LRU cache; or the alias of a cache in settings.CACHES
+# (e.g. "default") to share the cache among all the processes.
+CONTROLLED_VOCABULARY_SEARCH_CACHE = None
+
+# Maximum number of searches kept in the in-process cache
+CONTROLLED_VOCABULARY_SEARCH_CACHE_SIZE = 1000
+
+# Number of seconds a search result is cached.
+# Each vocabulary can override it with source["cache_ttl"]. 0 = no cache.
+CONTROLLED_VOCABULARY_SEARCH_CACHE_TTL = 60 * 60
+
+# Number of seconds empty results and failed searches are cached.
+# Each vocabulary can override it with source["negative_cache_ttl"].
+CONTROLLED_VOCABULARY_SEARCH_CACHE_NEGATIVE_TTL = 30
+
+# Requests to remote vocabularies (searches and downloads).
+# Number of seconds to wait for a connection / for data from the server.
+CONTROLLED_VOCABULARY_HTTP_CONNECT_TIMEOUT = 5
+CONTROLLED_VOCABULARY_HTTP_READ_TIMEOUT = 20
+# Number of retries after a failed request, waiting
+# BACKOFF * 2 ** (retry number - 1) seconds between two retries.
+CONTROLLED_VOCABULARY_HTTP_RETRIES = 2
+CONTROLLED_VOCABULARY_HTTP_BACKOFF = 0.5
+# Number of remote hosts and of connections per host kept alive
+CONTROLLED_VOCABULARY_HTTP_POOLS = 10
+CONTROLLED_VOCABULARY_HTTP_POOL_SIZE = 10
+
+# If True, the autocomplete widgets use the async view (Django 3.1+, ASGI)
+CONTROLLED_VOCABULARY_ASYNC_AUTOCOMPLETE = False
+
+# Federated search (see utils.search_federated):
+# number of seconds to wait for the vocabularies
+CONTROLLED_VOCABULARY_FEDERATED_SEARCH_DEADLINE = 3
+# maximum number of vocabularies searched at the same time
+CONTROLLED_VOCABULARY_FEDERATED_SEARCH_WORKERS = 20
+
+# Circuit breaker of each remote vocabulary (see vocabularies/breaker.py).
+# Stop calling a vocabulary for RESET_TIMEOUT seconds when at least
+# FAILURE_RATE of its last WINDOW searches (and at least MIN_CALLS)
+# failed or took more than SLOW_CALL seconds.
+CONTROLLED_VOCABULARY_BREAKER_FAILURE_RATE = 0.5
+CONTROLLED_VOCABULARY_BREAKER_MIN_CALLS = 5
+CONTROLLED_VOCABULARY_BREAKER_WINDOW = 20
+CONTROLLED_VOCABULARY_BREAKER_SLOW_CALL = 5
+CONTROLLED_VOCABULARY_BREAKER_RESET_TIMEOUT = 30
+
+# When the vocabulary records are written from the managers metadata
+# at startup (see ControlledVocabularyConfig.sync_vocabulary_records):
+# "auto": only if the managers or the database changed since last time
+# "always": at each start; "never": only after migrate and by 'vocab update'
+CONTROLLED_VOCABULARY_SYNC_RECORDS_ON_STARTUP = "auto"
+
+# Number of terms written in the database at a time (and per transaction)
+# by the bulk operations, e.g. utils.materialize_vocabulary()
+CONTROLLED_VOCABULARY_BULK_BATCH_SIZE = 500
+# maximum number of remote searches at the same time by
+# utils.search_term_many() (separate from the federated search)
+CONTROLLED_VOCABULARY_BULK_SEARCH_WORKERS = 4
+
+# Number of seconds the vocabularies offered by the autocomplete widgets
+# are cached (see models.filter_vocabularies). The cache is also cleared
+# each time a ControlledVocabulary is saved or deleted by this process.
+CONTROLLED_VOCABULARY_VOCABULARIES_CACHE_TTL = 60
+
+# If True, migrate creates a trigram index (pg_trgm) on the labels of the
+# terms, used by the case-insensitive 'contains' searches (PostgreSQL only).
+# The database user must be allowed to create the pg_trgm extension.
+CONTROLLED_VOCABULARY_TRIGRAM_INDEX = False
+
+# Search of the terms of the vocabularies without manager (see db_search.py).
+# None: the best backend for the database, or the import path of a class,
+# e.g. "controlled_vocabulary.db_search.DBSearchBackend"
+CONTROLLED_VOCABULARY_DB_SEARCH_BACKEND = None
+
+# Keys of ControlledTerm.data indexed by migrate (PostgreSQL only),
+# used by ControlledTerm.objects.filter_data(key=value), e.g. ["country"]
+# Run 'vocab index_data' after changing it (see data_indexes.py).
+CONTROLLED_VOCABULARY_DATA_INDEXED_KEYS = []
+
+# If True, the autocomplete widgets request the next pages of terms with
+# the cursor returned by the server rather than a page number,
+# which doesn't count or skip the previous terms (see pagination.py).
+CONTROLLED_VOCABULARY_CURSOR_PAGINATION = False
@@ -17,14 +17,39 @@ ACTION:
     a data source can be a CSV, RDF, ...
     note: some managers don't need source files
     note: does nothing if the file already exists
+    note: also writes a binary index of the terms next to the file (.idx)
   refetch
     same as fetch but always download the source data even if already on disk
+    note: skips files which haven't changed on the server (ETag/Last-Modified)
+  materialize
+    copy all the terms of the vocabularies into the database (ControlledTerm)
+    new terms are inserted, changed labels and descriptions are updated
+    note: only for managers which can list their terms (e.g. CSV)
+    e.g. vocab materialize -f iso639-2,mime
   managers
     lists the plugins / managers
+  index_data
+    creates or drops the indexes on the keys of the data of the terms
+    to match settings.CONTROLLED_VOCABULARY_DATA_INDEXED_KEYS
+    note: PostgreSQL only
+  status
+    shows whether the data source and the index of each CSV vocabulary
+    are up to date
+    stale: the file or the parser (parser_version) changed since indexing
+    missing: the data source hasn't been downloaded yet (see fetch)
   search
     look up a pattern in the vocabulary with the given prefix
     note: this bypasses the database and calls search() on the voc manager
     e.g. vocab search -f iso639-2 -p english
+  benchmark
+    shows the startup time of the app in this process and
+    compares the memory and search time of the compact term store
+    with plain lists of terms, for each list/CSV vocabulary
+    e.g. vocab benchmark -f iso639-2,mime -p eng
+  benchmark_db
+    times and explains the database queries used to search terms
+    on a temporary vocabulary of generated terms (rolled back at the end)
+    e.g. vocab benchmark_db -n 1000000
 
 OPTIONS:
 
@@ -35,6 +60,10 @@ OPTIONS:
   -p PATTERN
     a pattern to look up in a vocabulary
     pattern is a plain string, not a regular expression
+  -j JOBS
+    number of vocabularies fetched at the same time (default: 1)
+  -n COUNT
+    number of terms generated by benchmark_db (default: 1000000)
 
 """
 
@@ -56,6 +85,23 @@ OPTIONS:
             "-p", action="store", help="a string pattern to look up",
         )
 
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            action="store",
+            type=int,
+            default=1,
+            help="number of vocabularies fetched at the same time",
+        )
+
+        parser.add_argument(
+            "-n",
+            action="store",
+            type=int,
+            default=1000000,
+            help="number of terms generated by benchmark_db",
+        )
+
     def handle(self, *args, **options):
         show_help = True
 
@@ -94,6 +140,244 @@ OPTIONS:
             else:
                 self.stdout.write("{}: manager not found".format(prefix))
 
+    def action_benchmark(self):
+        import time
+        import tracemalloc
+
+        from ...vocabularies.base_list import VocabularyBaseList
+        from ...vocabularies.term_index import TermIndex, build_term_index
+
+        patterns = ["e", "en", "ima", "english", "zzz"]
+        pattern = (self.options["p"] or "").strip()
+        if pattern:
+            patterns = [pattern]
+        repeat = 20
+
+        self.stdout.write(
+            "startup (AppConfig.ready): {:.3f} ms, vocabulary records: {}".format(
+                self.app.startup["duration"] * 1000, self.app.startup["records"]
+            )
+        )
+
+        self._benchmark_imports()
+
+        template = "{:12.12} {:6.6} {:>8} {:>12} {:>12}"
+        self.stdout.write(
+            template.format("prefix", "store", "terms", "memory (MB)", "search (ms)")
+        )
+
+        for voc in self._get_vocabularies():
+            if not isinstance(voc, VocabularyBaseList):
+                continue
+
+            tracemalloc.start()
+            terms = sorted(voc._get_searchable_terms(), key=lambda t: t[1])
+            lists_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            tracemalloc.start()
+            manager = voc.__class__()
+            manager._searchable_terms = TermIndex(build_term_index(terms))
+            store_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            for store, memory, search in [
+                ["lists", lists_memory, lambda p: _search_term_lists(terms, p)],
+                ["index", store_memory, manager.search],
+            ]:
+                start = time.perf_counter()
+                for i in range(repeat):
+                    for pattern in patterns:
+                        search(pattern)
+                duration = time.perf_counter() - start
+
+                self.stdout.write(
+                    template.format(
+                        voc.prefix,
+                        store,
+                        len(terms),
+                        "{:.3f}".format(memory / 1024 / 1024),
+                        "{:.3f}".format(
+                            duration * 1000 / repeat / len(patterns)
+                        ),
+                    )
+                )
+
+    def action_benchmark_db(self):
+        import time
+
+        from django.db import connection, transaction
+        from django.db.models import Q
+
+        from ...models import ControlledTerm, ControlledVocabulary
+        from ...utils import _filter_terms_iexact
+
+        count = self.options["n"]
+        pattern = (self.options["p"] or "").strip() or "Term {}".format(count // 2)
+        repeat = 5
+
+        with transaction.atomic():
+            vocabulary = ControlledVocabulary.objects.create(
+                prefix="benchmark-db", label="Benchmark (temporary)"
+            )
+
+            start = time.perf_counter()
+            batch_size = 10000
+            for i in range(0, count, batch_size):
+                ControlledTerm.objects.bulk_create(
+                    ControlledTerm(
+                        vocabulary=vocabulary,
+                        termid="t{}".format(j),
+                        label="Term {}".format(j),
+                    )
+                    for j in range(i, min(count, i + batch_size))
+                )
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "ANALYZE {}".format(
+                        connection.ops.quote_name(ControlledTerm._meta.db_table)
+                    )
+                )
+            self.stdout.write(
+                "{} ({}): {} terms generated in {:.1f}s".format(
+                    connection.vendor,
+                    connection.settings_dict["NAME"],
+                    count,
+                    time.perf_counter() - start,
+                )
+            )
+
+            terms = ControlledTerm.objects.filter(vocabulary__prefix=vocabulary.prefix)
+            queries = [
+                ["search_term()", _filter_terms_iexact(terms, pattern)],
+                [
+                    "iexact (without LOWER index)",
+                    terms.filter(Q(termid__iexact=pattern) | Q(label__iexact=pattern)),
+                ],
+                ["icontains (TermListView)", terms.filter(label__icontains=pattern)],
+            ]
+            for title, query in queries:
+                query = query.select_related(None)[:10]
+                start = time.perf_counter()
+                for i in range(repeat):
+                    list(query)
+                self.stdout.write(
+                    "\n{}: {:.3f} ms".format(
+                        title, (time.perf_counter() - start) * 1000 / repeat
+                    )
+                )
+                self.stdout.write(query.explain())
+
+            transaction.set_rollback(True)
+
+    def _benchmark_imports(self):
+        """Shows the time it takes to load the registry of the managers
+        and to import each vocabulary module in a new process."""
+        import os
+        import subprocess
+        import sys
+        import time
+
+        from ...settings import get_var
+        from ...vocabularies.registry import VocabularyRegistry
+
+        start = time.perf_counter()
+        VocabularyRegistry(get_var("VOCABULARIES"))
+        self.stdout.write(
+            "registry (from manifest): {:.3f} ms".format(
+                (time.perf_counter() - start) * 1000
+            )
+        )
+
+        code = (
+            "import importlib, sys, time, django; django.setup(); "
+            "start = time.perf_counter(); importlib.import_module(sys.argv[1]); "
+            "print(time.perf_counter() - start)"
+        )
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+        template = "{:50.50} {:>12}"
+        self.stdout.write(template.format("module", "import (ms)"))
+        registry = self.app.vocabulary_managers
+        prefixes = self._get_prefixes()
+        modules = {
+            registry.get_module_path(prefix)
+            for prefix in registry
+            if not prefixes or prefix in prefixes
+        }
+        for module in sorted(modules):
+            res = subprocess.run(
+                [sys.executable, "-c", code, module],
+                env=env,
+                # Python 3.6 (no capture_output / text arguments)
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            try:
+                duration = "{:.3f}".format(float(res.stdout.strip()) * 1000)
+            except ValueError:
+                duration = "error"
+            self.stdout.write(template.format(module, duration))
+
+    def action_materialize(self):
+        from ...utils import materialize_vocabulary
+
+        ret = True
+
+        for voc in self._get_vocabularies():
+            if not hasattr(voc, "_get_searchable_terms"):
+                continue
+
+            try:
+                stats = materialize_vocabulary(voc.prefix)
+            except Exception as e:
+                self.stdout.write(
+                    "ERROR: {}: materialization failed ({}).".format(voc.prefix, e)
+                )
+                ret = False
+                continue
+
+            if self.options["verbosity"] > 0:
+                self.stdout.write(
+                    "{}: {} terms, {} created, {} updated "
+                    "in {:.2f}s ({:.0f} rows/s)".format(
+                        voc.prefix,
+                        stats["terms"],
+                        stats["created"],
+                        stats["updated"],
+                        stats["duration"],
+                        stats["terms"] / max(stats["duration"], 1e-6),
+                    )
+                )
+
+        return ret
+
+    def action_index_data(self):
+        from django.db import connection
+
+        from ...data_indexes import sync_data_indexes
+        from ...models import ControlledTerm
+        from ...settings import get_var
+
+        if connection.vendor != "postgresql":
+            self.stdout.write("The data indexes are only supported on PostgreSQL.")
+            return
+
+        with connection.schema_editor() as schema_editor:
+            created, dropped = sync_data_indexes(
+                schema_editor,
+                ControlledTerm._meta.db_table,
+                get_var("DATA_INDEXED_KEYS"),
+            )
+
+        if self.options["verbosity"] > 0:
+            for action, names in [["created", created], ["dropped", dropped]]:
+                for name in names:
+                    self.stdout.write("{} {}".format(action, name))
+            if not (created or dropped):
+                self.stdout.write("The data indexes are up to date.")
+
     def action_managers(self):
         template = "{:12.12} {:25.25} {:22.22} {}"
         self.stdout.write(template.format("prefix", "concept", "base", "module"))
@@ -119,15 +403,59 @@ OPTIONS:
     def action_refetch(self):
         return self.action_fetch(True)
 
+    def action_status(self):
+        import os
+
+        from ...vocabularies.base_csv import VocabularyBaseCSV
+
+        template = "{:12.12} {:8} {:>7} {:12} {}"
+        self.stdout.write(
+            template.format("prefix", "status", "parser", "sha256", "file")
+        )
+
+        for voc in self._get_vocabularies():
+            if not isinstance(voc, VocabularyBaseCSV):
+                continue
+
+            filepath = voc._get_filepath()
+            sha256 = ""
+            if not os.path.exists(filepath):
+                status = "missing"
+            else:
+                sha256 = voc.get_fingerprint()["sha256"][:12]
+                status = "stale" if voc.is_index_stale() else "ok"
+
+            self.stdout.write(
+                template.format(
+                    voc.prefix, status, voc.parser_version, sha256, filepath
+                )
+            )
+
     def action_fetch(self, overwrite=False):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
         ret = True
 
-        for voc in self._get_vocabularies():
-            download_method = getattr(voc, "download", None)
-            if download_method:
+        vocs = [
+            voc for voc in self._get_vocabularies() if getattr(voc, "download", None)
+        ]
+
+        with ThreadPoolExecutor(max_workers=max(1, self.options["jobs"])) as pool:
+            futures = {
+                pool.submit(self._fetch_vocabulary, voc, overwrite): voc
+                for voc in vocs
+            }
+            for future in as_completed(futures):
+                voc = futures[future]
                 if self.options["verbosity"] > 0:
                     self.stdout.write(voc.prefix)
-                url, filepath, size, downloaded = download_method(overwrite=overwrite)
+                try:
+                    url, filepath, size, downloaded, duration = future.result()
+                except Exception as e:
+                    self.stdout.write(f"ERROR: vocabulary fetch failed ({e}).")
+                    ret = False
+                    continue
+
                 if self.options["verbosity"] > 0:
                     if size > 0:
                         self.stdout.write(
@@ -135,6 +463,16 @@ OPTIONS:
                                 url, filepath, size / 1024 / 1024
                             )
                         )
+                        if downloaded:
+                            self.stdout.write(
+                                "\tdownloaded in {:.2f}s ({:.3f}MB/s)".format(
+                                    duration, size / 1024 / 1024 / max(duration, 1e-6)
+                                )
+                            )
+                        else:
+                            self.stdout.write(
+                                "\tnot downloaded ({:.2f}s)".format(duration)
+                            )
                     else:
                         self.stdout.write(f"ERROR: vocabulary download failed {url}.")
                 if size < 1:
@@ -142,9 +480,21 @@ OPTIONS:
 
         return ret
 
+    def _fetch_vocabulary(self, voc, overwrite):
+        """Downloads and processes the data source of a vocabulary.
+        Returns [url, filepath, size, downloaded, duration in seconds]
+        """
+        import time
+
+        start = time.monotonic()
+        ret = voc.download(overwrite=overwrite)
+        ret.append(time.monotonic() - start)
+
+        return ret
+
     def action_init(self):
         self.action_update()
-        self.action_fetch()
+        return self.action_fetch()
 
     def action_transform(self):
         for voc in self._get_vocabularies():
@@ -158,10 +508,12 @@ OPTIONS:
         Or only those selected with -f arg on the command line.
         """
         prefixes = self._get_prefixes()
+        managers = self.app.vocabulary_managers
+        # only import the modules of the selected vocabularies
         ret = [
-            voc
-            for voc in self.app.vocabulary_managers.values()
-            if not prefixes or voc.prefix in prefixes
+            managers[prefix]
+            for prefix in managers
+            if not prefixes or prefix in prefixes
         ]
 
         return ret
@@ -176,3 +528,32 @@ OPTIONS:
         if prefixes:
             ret = prefixes.split(",")
         return ret
+
+
+def _search_term_lists(terms, pattern):
+    """Reference search over plain lists of terms (sorted by label),
+    with a full scan and sort. See VocabularyBaseList.search().
+    Only used to benchmark the term store.
+    """
+    ret = []
+
+    pattern = pattern.lower()
+
+    for term in terms:
+        score = 0
+        label = term[1].lower()
+        if pattern in label:
+            score += 1
+        if term[0].lower() == pattern:
+            score += 4
+        if score:
+            if label.startswith(pattern):
+                score += 1
+            if label == pattern:
+                score += 1
+            desc = ""
+            if len(term) > 2:
+                desc = term[2]
+            ret.append([term[0], term[1], desc, score])
+
+    return sorted(ret, key=lambda t: [-t[3], t[1], t[2]])
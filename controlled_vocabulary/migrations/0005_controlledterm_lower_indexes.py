@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# name of the index: indexed column
+LOWER_INDEXES = {
+    "controlled_vocabulary_term_label_lower": "label",
+    "controlled_vocabulary_term_termid_lower": "termid",
+}
+
+TRIGRAM_INDEX = "controlled_vocabulary_term_label_trgm"
+
+
+def create_indexes(migration_apps, schema_editor):
+    '''
+    Case-insensitive indexes on the terms of each vocabulary,
+    used by utils.search_term().
+    Expression indexes are only created on SQLite and PostgreSQL.
+
+    On PostgreSQL, if settings.CONTROLLED_VOCABULARY_TRIGRAM_INDEX is True,
+    also creates a trigram index used by label__icontains.
+    '''
+    from controlled_vocabulary.settings import get_var
+
+    term_model = migration_apps.get_model("controlled_vocabulary", "ControlledTerm")
+    vendor = schema_editor.connection.vendor
+    quote = schema_editor.quote_name
+    table = quote(term_model._meta.db_table)
+
+    if vendor in ["sqlite", "postgresql"]:
+        vocabulary = quote(term_model._meta.get_field("vocabulary").column)
+        for name, column in LOWER_INDEXES.items():
+            schema_editor.execute(
+                "CREATE INDEX {} ON {} ({}, LOWER({}))".format(
+                    quote(name), table, vocabulary, quote(column)
+                )
+            )
+
+    if vendor == "postgresql" and get_var("TRIGRAM_INDEX"):
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        # same expression as the one generated by label__icontains
+        schema_editor.execute(
+            "CREATE INDEX {} ON {} USING gin ((UPPER({}::text)) gin_trgm_ops)".format(
+                quote(TRIGRAM_INDEX), table, quote("label")
+            )
+        )
+
+
+def drop_indexes(migration_apps, schema_editor):
+    if schema_editor.connection.vendor in ["sqlite", "postgresql"]:
+        for name in list(LOWER_INDEXES) + [TRIGRAM_INDEX]:
+            schema_editor.execute(
+                "DROP INDEX IF EXISTS {}".format(schema_editor.quote_name(name))
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("controlled_vocabulary", "0004_remove_controlledvocabulary_test"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
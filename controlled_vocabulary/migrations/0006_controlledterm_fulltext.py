@@ -0,0 +1,92 @@
+from django.db import migrations
+
+# see db_search.py
+SQLITE_FTS_TABLE = "controlled_vocabulary_term_fts"
+POSTGRESQL_INDEX = "controlled_vocabulary_term_label_tsv"
+
+
+def create_fulltext_index(migration_apps, schema_editor):
+    '''
+    Full-text index of the labels of the terms, see db_search.py.
+
+    SQLite (3.34+ with FTS5): a FTS5 table with a trigram tokenizer,
+    kept in sync with the terms by triggers.
+    Note that the triggers make any change to the terms fail if the
+    database is later opened by a SQLite without FTS5 (or older than
+    3.34), unless this migration is reversed first.
+    PostgreSQL: a GIN index on to_tsvector('simple', label),
+    used by the (opt-in) PostgreSQLSearchBackend.
+    '''
+    term_model = migration_apps.get_model("controlled_vocabulary", "ControlledTerm")
+    connection = schema_editor.connection
+    quote = schema_editor.quote_name
+    table = quote(term_model._meta.db_table)
+
+    if connection.vendor == "sqlite" and _is_fts5_trigram_supported(connection):
+        fts = quote(SQLITE_FTS_TABLE)
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE {} USING fts5(label, content={}, "
+            "content_rowid='id', tokenize='trigram')".format(fts, table)
+        )
+        schema_editor.execute("INSERT INTO {0}({0}) VALUES('rebuild')".format(fts))
+
+        delete = "INSERT INTO {0}({0}, rowid, label) VALUES('delete', old.id, old.label);"
+        insert = "INSERT INTO {}(rowid, label) VALUES (new.id, new.label);"
+        for name, event, statements in [
+            ["ai", "INSERT", [insert]],
+            ["ad", "DELETE", [delete]],
+            ["au", "UPDATE", [delete, insert]],
+        ]:
+            schema_editor.execute(
+                "CREATE TRIGGER {} AFTER {} ON {} BEGIN {} END".format(
+                    quote("{}_{}".format(SQLITE_FTS_TABLE, name)),
+                    event,
+                    table,
+                    " ".join(statement.format(fts) for statement in statements),
+                )
+            )
+
+    if connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX {} ON {} USING gin (to_tsvector('simple', label))".format(
+                quote(POSTGRESQL_INDEX), table
+            )
+        )
+
+
+def drop_fulltext_index(migration_apps, schema_editor):
+    quote = schema_editor.quote_name
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "sqlite":
+        for name in ["ai", "ad", "au"]:
+            schema_editor.execute(
+                "DROP TRIGGER IF EXISTS {}".format(
+                    quote("{}_{}".format(SQLITE_FTS_TABLE, name))
+                )
+            )
+        schema_editor.execute("DROP TABLE IF EXISTS {}".format(quote(SQLITE_FTS_TABLE)))
+
+    if vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS {}".format(quote(POSTGRESQL_INDEX)))
+
+
+def _is_fts5_trigram_supported(connection):
+    import sqlite3
+
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        options = [row[0] for row in cursor.fetchall()]
+
+    return sqlite3.sqlite_version_info >= (3, 34, 0) and "ENABLE_FTS5" in options
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("controlled_vocabulary", "0005_controlledterm_lower_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
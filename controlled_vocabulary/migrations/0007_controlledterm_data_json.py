@@ -0,0 +1,109 @@
+import json
+from importlib import import_module
+
+from django.db import migrations, models
+
+# indexes created by the previous migrations with raw SQL,
+# SQLite drops them when the table of the terms is rebuilt by AlterField
+lower_indexes = import_module(
+    "controlled_vocabulary.migrations.0005_controlledterm_lower_indexes"
+)
+fulltext = import_module("controlled_vocabulary.migrations.0006_controlledterm_fulltext")
+
+
+def drop_sqlite_indexes(migration_apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        fulltext.drop_fulltext_index(migration_apps, schema_editor)
+        lower_indexes.drop_indexes(migration_apps, schema_editor)
+
+
+def create_sqlite_indexes(migration_apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        lower_indexes.create_indexes(migration_apps, schema_editor)
+        fulltext.create_fulltext_index(migration_apps, schema_editor)
+
+
+def convert_text_to_json(migration_apps, schema_editor):
+    '''
+    Makes the content of ControlledTerm.data valid JSON before the
+    column is converted:
+        empty string => NULL
+        text which is not JSON => JSON string, e.g. abc => "abc"
+    '''
+    from controlled_vocabulary.settings import get_var
+
+    term_model = migration_apps.get_model("controlled_vocabulary", "ControlledTerm")
+    batch_size = get_var("BULK_BATCH_SIZE")
+
+    updated = []
+    terms = term_model.objects.exclude(data=None).only("id", "data")
+    for term in terms.iterator(chunk_size=batch_size):
+        data = _get_valid_json(term.data)
+        if data != term.data:
+            term.data = data
+            updated.append(term)
+            if len(updated) >= batch_size:
+                term_model.objects.bulk_update(updated, ["data"])
+                updated = []
+
+    if updated:
+        term_model.objects.bulk_update(updated, ["data"])
+
+
+def _get_valid_json(text):
+    ret = text
+    if not text.strip():
+        ret = None
+    else:
+        try:
+            # NaN and Infinity are not valid JSON for the databases
+            json.loads(text, parse_constant=_reject_constant)
+        except ValueError:
+            ret = json.dumps(text)
+
+    return ret
+
+
+def _reject_constant(constant):
+    raise ValueError("invalid JSON constant: {}".format(constant))
+
+
+def create_data_indexes(migration_apps, schema_editor):
+    '''
+    PostgreSQL: one index on each key of ControlledTerm.data listed in
+    settings.CONTROLLED_VOCABULARY_DATA_INDEXED_KEYS, see data_indexes.py.
+    '''
+    from controlled_vocabulary.data_indexes import sync_data_indexes
+    from controlled_vocabulary.settings import get_var
+
+    term_model = migration_apps.get_model("controlled_vocabulary", "ControlledTerm")
+    sync_data_indexes(
+        schema_editor, term_model._meta.db_table, get_var("DATA_INDEXED_KEYS")
+    )
+
+
+def drop_data_indexes(migration_apps, schema_editor):
+    from controlled_vocabulary.data_indexes import sync_data_indexes
+
+    term_model = migration_apps.get_model("controlled_vocabulary", "ControlledTerm")
+    # all of them, including those added since by 'vocab index_data'
+    sync_data_indexes(schema_editor, term_model._meta.db_table, [])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("controlled_vocabulary", "0006_controlledterm_fulltext"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_sqlite_indexes, create_sqlite_indexes),
+        migrations.RunPython(convert_text_to_json, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="controlledterm",
+            name="data",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(create_sqlite_indexes, drop_sqlite_indexes),
+        migrations.RunPython(create_data_indexes, drop_data_indexes),
+    ]
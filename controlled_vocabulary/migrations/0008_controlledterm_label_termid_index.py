@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controlled_vocabulary', '0007_controlledterm_data_json'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='controlledterm',
+            index=models.Index(fields=['vocabulary', 'label', 'termid'], name='controlled_term_label_termid'),
+        ),
+    ]
@@ -1,8 +1,11 @@
+import threading
 import urllib.parse
+from collections import OrderedDict
 
 from django import forms
 from django.contrib.admin.widgets import AutocompleteSelect, AutocompleteSelectMultiple
 from django.db import models
+from django.db.models.constants import LOOKUP_SEP
 from django.forms.widgets import SelectMultiple
 from django.urls.base import reverse
 
@@ -12,23 +15,102 @@ LENGTH_IDENTIFIER = 50
 LOCAL_VOCABULARY_BASE_URL = "http://localhost:8000/vocabularies"
 
 
+class ControlledTermQuerySet(models.QuerySet):
+    # The vocabulary is fetched with the terms by default
+    # (see ControlledTermManager), unless it is deferred
+    # or the terms are locked.
+
+    def only(self, *fields):
+        ret = super().only(*fields)
+        if not any(
+            field.split(LOOKUP_SEP)[0] in ["vocabulary", "vocabulary_id"]
+            for field in fields
+        ):
+            ret = ret._without_vocabulary_join()
+        return ret
+
+    def defer(self, *fields):
+        ret = super().defer(*fields)
+        if "vocabulary" in fields or "vocabulary_id" in fields:
+            ret = ret._without_vocabulary_join()
+        return ret
+
+    def select_for_update(self, *args, **kwargs):
+        """Only locks the terms, unless the vocabulary is explicitly
+        locked with of=("self", "vocabulary")."""
+        ret = self
+        if not kwargs.get("of", None):
+            ret = ret._without_vocabulary_join()
+        return super(ControlledTermQuerySet, ret).select_for_update(*args, **kwargs)
+
+    def _without_vocabulary_join(self):
+        ret = self
+        related = self.query.select_related
+        if isinstance(related, dict) and "vocabulary" in related:
+            ret = self._chain()
+            related = {k: v for k, v in related.items() if k != "vocabulary"}
+            ret.query.select_related = related or False
+        return ret
+
+    def filter_data(self, **lookups):
+        """Returns the terms which metadata (ControlledTerm.data)
+        match the <lookups>, in the database.
+        e.g. filter_data(country="fr", year__gte=1900)
+        is the same as filter(data__country="fr", data__year__gte=1900)
+
+        On PostgreSQL, the keys listed in
+        settings.CONTROLLED_VOCABULARY_DATA_INDEXED_KEYS are indexed.
+        """
+        return self.filter(
+            **{"data__{}".format(lookup): value for lookup, value in lookups.items()}
+        )
+
+
+class ControlledTermManager(models.Manager.from_queryset(ControlledTermQuerySet)):
+    """Fetches the vocabulary with the terms (see ControlledTerm.__str__)."""
+
+    def get_queryset(self):
+        return super().get_queryset().select_related("vocabulary")
+
+
 class ControlledTerm(models.Model):
     vocabulary = models.ForeignKey("ControlledVocabulary", on_delete=models.CASCADE)
     termid = models.CharField(max_length=LENGTH_LABEL)
     label = models.CharField(max_length=LENGTH_LABEL)
     description = models.TextField(null=True, blank=True)
 
-    # We store json in this field.
-    # Only Postgresql supports JSONField at this time.
-    data = models.TextField(null=True, blank=True)
+    # metadata about the term, see ControlledTermQuerySet.filter_data()
+    data = models.JSONField(null=True, blank=True)
+
+    objects = ControlledTermManager()
 
     class Meta:
         ordering = ["termid"]
         unique_together = ["vocabulary", "termid"]
         verbose_name = "Controlled Term"
+        indexes = [
+            # terms sorted by label, see pagination.CursorPage
+            models.Index(
+                fields=["vocabulary", "label", "termid"],
+                name="controlled_term_label_termid",
+            ),
+        ]
+
+    def get_vocabulary(self):
+        """Returns the vocabulary of this term without querying the database,
+        unless it hasn't been fetched with the term
+        and isn't in the cache of get_vocabulary_by_id()."""
+        ret = None
+        if ControlledTerm.vocabulary.is_cached(self):
+            ret = self.vocabulary
+        elif self.vocabulary_id is not None:
+            ret = get_vocabulary_by_id(self.vocabulary_id)
+        if ret is None:
+            ret = self.vocabulary
+        return ret
 
     def get_absolute_url(self):
-        ret = self.vocabulary.get_absolute_url()
+        ret = self.get_vocabulary().get_absolute_url()
         if not ret.endswith("/"):
             ret += "/"
         ret += self.termid
@@ -39,7 +121,7 @@ class ControlledTerm(models.Model):
         return self.get_absolute_url()
 
     def get_absolute_id(self):
-        return "{}:{}".format(self.vocabulary.prefix_base, self.termid)
+        return "{}:{}".format(self.get_vocabulary().prefix_base, self.termid)
 
     @classmethod
     def get_or_create_from_code(cls, code):
@@ -70,8 +152,88 @@ class ControlledTerm(models.Model):
 
         return ret
 
+    @classmethod
+    def get_or_create_many(cls, terms):
+        """Returns the ControlledTerm records for <terms>, in the same order.
+        The missing records are created.
+
+        terms: a list of (vocabulary_id, termid, label, description)
+
+        Existing records are fetched with one query per batch of
+        settings.CONTROLLED_VOCABULARY_BULK_BATCH_SIZE terms.
+        The missing ones are inserted with bulk_create() then fetched.
+        """
+        from .settings import get_var
+
+        batch_size = get_var("BULK_BATCH_SIZE")
+
+        # e.g. "3" -> 3
+        to_python = cls._meta.get_field("vocabulary").target_field.to_python
+        terms = [[to_python(term[0])] + list(term[1:]) for term in terms]
+
+        # (vocabulary_id, termid): term, the first term wins
+        values = {}
+        for term in terms:
+            values.setdefault((term[0], term[1]), term)
+
+        records = cls._get_many(list(values), batch_size)
+
+        missing = [
+            cls(
+                vocabulary_id=key[0], termid=key[1], label=term[2], description=term[3]
+            )
+            for key, term in values.items()
+            if key not in records
+        ]
+        if missing:
+            # a concurrent request may have inserted some of these terms
+            cls.objects.bulk_create(
+                missing, batch_size=batch_size, ignore_conflicts=True
+            )
+            records.update(
+                cls._get_many(
+                    [(term.vocabulary_id, term.termid) for term in missing],
+                    batch_size,
+                )
+            )
+            # rows silently skipped by ignore_conflicts (e.g. not a
+            # duplicate), created one by one to raise the actual error
+            for term in missing:
+                key = (term.vocabulary_id, term.termid)
+                if key not in records:
+                    records[key], _ = cls.objects.get_or_create(
+                        vocabulary_id=key[0],
+                        termid=key[1],
+                        defaults={"label": term.label, "description": term.description},
+                    )
+
+        return [records[(term[0], term[1])] for term in terms]
+
+    @classmethod
+    def _get_many(cls, keys, batch_size):
+        """Returns {(vocabulary_id, termid): ControlledTerm}
+        for the existing records matching <keys>."""
+        from django.db.models import Q
+
+        ret = {}
+        for i in range(0, len(keys), batch_size):
+            termids = {}
+            for vocabulary_id, termid in keys[i:i + batch_size]:
+                termids.setdefault(vocabulary_id, []).append(termid)
+
+            condition = Q()
+            for vocabulary_id, vocabulary_termids in termids.items():
+                condition |= Q(
+                    vocabulary_id=vocabulary_id, termid__in=vocabulary_termids
+                )
+
+            for record in cls.objects.filter(condition).select_related(None):
+                ret[(record.vocabulary_id, record.termid)] = record
+
+        return ret
+
     def __str__(self):
-        return "{} ({})".format(self.label, self.vocabulary.prefix)
+        return "{} ({})".format(self.label, self.get_vocabulary().prefix)
 
 
 class ControlledTermWidgetMixin:
@@ -88,32 +250,16 @@ class ControlledTermWidgetMixin:
         super().__init__(rel, admin_site, attrs=attrs, choices=choices, using=using)
 
     def get_url(self):
+        from .settings import get_var
+
+        if get_var("ASYNC_AUTOCOMPLETE"):
+            return reverse(self.url_name + "_async")
         return reverse(self.url_name)
 
     def get_context(self, name, value, attrs):
-        from django.db.models import Q
-
         context = super().get_context(name, value, attrs)
 
-        context["vocabularies"] = ControlledVocabulary.objects.all()
-
-        if "" not in self.vocabularies:
-            # filter vocabularies based on their prefix or concept
-            # e,g, ['iso-639-2', 'concept.wikidata:Q35120']
-            context["vocabularies"] = context["vocabularies"].filter(
-                Q(
-                    prefix__in=[
-                        voc for voc in self.vocabularies if "concept." not in voc
-                    ]
-                )
-                | Q(
-                    concept__termid__in=[
-                        voc.split(":")[-1]
-                        for voc in self.vocabularies
-                        if "concept." in voc
-                    ]
-                )
-            )
+        context["vocabularies"] = filter_vocabularies(self.vocabularies)
 
         default_voc = context["vocabularies"][0]
         for voc in context["vocabularies"]:
@@ -125,6 +271,11 @@ class ControlledTermWidgetMixin:
         context["default_prefix"] = prefix
         context["widget"]["attrs"]["data-voc-prefix"] = prefix
 
+        from .settings import get_var
+
+        if get_var("CURSOR_PAGINATION"):
+            context["widget"]["attrs"]["data-cursor-pagination"] = "1"
+
         return context
 
     @property
@@ -165,28 +316,139 @@ class ControlledTermWidgetMixin:
         return term_create_from_string(value)
 
 
+# (vocabularies): (expiry time, [ControlledVocabulary]),
+# see filter_vocabularies(). Least recently used entries are evicted
+# (the federated autocomplete takes <vocabularies> from the request).
+_vocabularies_cache = OrderedDict()
+_vocabularies_cache_lock = threading.Lock()
+VOCABULARIES_CACHE_SIZE = 100
+# (expiry time, {id: ControlledVocabulary}), see get_vocabulary_by_id()
+_vocabularies_by_id = [0, {}]
+
+
+def filter_vocabularies(vocabularies):
+    """Returns a list of the ControlledVocabulary matching
+    any entry in <vocabularies>. See ControlledTermField for the format.
+    e,g, ['iso-639-2', 'concept.wikidata:Q35120']
+
+    The list is cached for each value of <vocabularies>, until a
+    ControlledVocabulary is saved or deleted in this process, or for
+    settings.CONTROLLED_VOCABULARY_VOCABULARIES_CACHE_TTL seconds
+    (changes made by other processes).
+    """
+    import time
+
+    from .settings import get_var
+
+    key = tuple(vocabularies)
+    with _vocabularies_cache_lock:
+        entry = _vocabularies_cache.get(key, None)
+        if entry is not None:
+            _vocabularies_cache.move_to_end(key)
+
+    if entry is None or entry[0] < time.monotonic():
+        entry = (
+            time.monotonic() + get_var("VOCABULARIES_CACHE_TTL"),
+            list(_filter_vocabularies(vocabularies)),
+        )
+        with _vocabularies_cache_lock:
+            _vocabularies_cache[key] = entry
+            _vocabularies_cache.move_to_end(key)
+            while len(_vocabularies_cache) > VOCABULARIES_CACHE_SIZE:
+                _vocabularies_cache.popitem(last=False)
+
+    return list(entry[1])
+
+
+def get_vocabulary_by_id(vocabulary_id):
+    """Returns the ControlledVocabulary with the given id, or None.
+    All the vocabularies are fetched with one query and cached,
+    like filter_vocabularies().
+    The returned record is shared, it must not be modified.
+    """
+    import time
+
+    from .settings import get_var
+
+    if _vocabularies_by_id[0] < time.monotonic():
+        _vocabularies_by_id[:] = [
+            time.monotonic() + get_var("VOCABULARIES_CACHE_TTL"),
+            {record.id: record for record in ControlledVocabulary.objects.all()},
+        ]
+
+    return _vocabularies_by_id[1].get(vocabulary_id, None)
+
+
+def clear_vocabularies_cache(*args, **kwargs):
+    """Empties the caches of filter_vocabularies()
+    and get_vocabulary_by_id()."""
+    with _vocabularies_cache_lock:
+        _vocabularies_cache.clear()
+    _vocabularies_by_id[:] = [0, {}]
+
+
+def _filter_vocabularies(vocabularies):
+    """Returns a queryset of the ControlledVocabulary matching
+    any entry in <vocabularies>, see filter_vocabularies()."""
+    from django.db.models import Q
+
+    ret = ControlledVocabulary.objects.all()
+
+    if "" not in vocabularies:
+        # filter vocabularies based on their prefix or concept
+        ret = ret.filter(
+            Q(prefix__in=[voc for voc in vocabularies if "concept." not in voc])
+            | Q(
+                concept__termid__in=[
+                    voc.split(":")[-1] for voc in vocabularies if "concept." in voc
+                ]
+            )
+        )
+
+    return ret
+
+
 def term_create_from_string(value):
     """Get or create a term from a string value. The string must follow the format:
     vocabulary_id::term_id::term_label::term_description. The term_description is
     optional."""
-    if not value:
-        return None
+    return terms_create_from_strings([value])[0]
+
+
+def terms_create_from_strings(values):
+    """Same as term_create_from_string() for each value in <values>.
+    Returns the results in the same order.
+    The existing terms are fetched with one query
+    and the missing ones created with one bulk insert,
+    see ControlledTerm.get_or_create_many().
+    """
+    ret = []
 
-    parts = str(value).split("::")
-    if len(parts) < 3:
-        return value
+    # position in ret: (vocabulary_id, termid, label, description)
+    terms = {}
+    for value in values:
+        if not value:
+            ret.append(None)
+            continue
 
-    desc = None
-    if len(parts) == 4:
-        desc = urllib.parse.unquote_plus(parts[3])
+        parts = str(value).split("::")
+        if len(parts) < 3:
+            ret.append(value)
+            continue
 
-    term, created = ControlledTerm.objects.get_or_create(
-        vocabulary_id=parts[0],
-        termid=parts[1],
-        defaults={"label": parts[2], "description": desc},
-    )
+        desc = None
+        if len(parts) == 4:
+            desc = urllib.parse.unquote_plus(parts[3])
 
-    return term.id
+        terms[len(ret)] = (parts[0], parts[1], parts[2], desc)
+        ret.append(None)
+
+    if terms:
+        records = ControlledTerm.get_or_create_many(list(terms.values()))
+        for i, record in zip(terms.keys(), records):
+            ret[i] = record.id
+
+    return ret
 
 
 class ControlledTermWidget(ControlledTermWidgetMixin, AutocompleteSelect):
@@ -199,7 +461,7 @@ class ControlledTermsWidget(ControlledTermWidgetMixin, AutocompleteSelectMultipl
         ret = value
 
         if isinstance(ret, list):
-            ret = [self._value_from_datadict_single(val) for val in ret]
+            ret = terms_create_from_strings(ret)
 
         return ret
 
@@ -306,3 +568,15 @@ class ControlledVocabulary(models.Model):
 
     def __str__(self):
         return self.label
+
+
+models.signals.post_save.connect(
+    clear_vocabularies_cache,
+    sender=ControlledVocabulary,
+    dispatch_uid="controlled_vocabulary_clear_vocabularies_cache_save",
+)
+models.signals.post_delete.connect(
+    clear_vocabularies_cache,
+    sender=ControlledVocabulary,
+    dispatch_uid="controlled_vocabulary_clear_vocabularies_cache_delete",
+)
@@ -0,0 +1,125 @@
+"""
+Cursor pagination of the autocomplete (see TermListView).
+
+When the request has a 'cursor' parameter (empty for the first page),
+the response returns the page of terms following that cursor and
+pagination.more is the (opaque) cursor of the next page, or false.
+Unlike the 'page' parameter, it doesn't count the terms
+or skip the terms of the previous pages.
+
+The cursor is the position of the last term of the page, signed:
+    terms from the database (queryset):
+        its [score], label and termid, to filter the next terms
+        (WHERE label >= %s AND (label > %s OR termid > %s))
+    terms from a vocabulary manager (sequence):
+        its offset in the search results
+"""
+from django.core import signing
+from django.core.exceptions import SuspiciousOperation
+from django.db.models import Q
+from django.db.models.query import QuerySet
+
+CURSOR_SALT = "controlled_vocabulary.cursor"
+
+
+class CursorPage:
+    """The page of <terms> following the position in <cursor>.
+    <terms> is a ControlledTerm queryset or a sequence of ControlledTerm.
+    Iterable like django.core.paginator.Page.
+    """
+
+    def __init__(self, terms, cursor, page_size, scope=""):
+        self.scope = scope
+        position = decode_cursor(cursor, scope)
+
+        if isinstance(terms, QuerySet):
+            self.object_list, position = self._get_terms_after_key(
+                terms, position, page_size
+            )
+        else:
+            self.object_list, position = self._get_terms_after_offset(
+                terms, position, page_size
+            )
+
+        self.next_cursor = None
+        if position is not None:
+            self.next_cursor = encode_cursor(position, scope)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def _get_terms_after_key(self, terms, position, page_size):
+        """Returns the terms following <position> and the position of the
+        last one (None if there are no more terms)."""
+        scored = "score" in terms.query.annotations
+        if scored:
+            terms = terms.order_by("-score", "label", "termid")
+        else:
+            terms = terms.order_by("label", "termid")
+
+        if position:
+            label, termid = position["label"], position["termid"]
+            after = Q(label__gt=label) | Q(label=label, termid__gt=termid)
+            if scored:
+                score = position["score"]
+                terms = terms.filter(Q(score__lt=score) | Q(score=score) & after)
+            else:
+                # label >= %s can use the (vocabulary, label, termid) index
+                terms = terms.filter(Q(label__gte=label) & after)
+
+        ret = list(terms[:page_size + 1])
+
+        position = None
+        if len(ret) > page_size:
+            ret = ret[:page_size]
+            last = ret[-1]
+            position = {"label": last.label, "termid": last.termid}
+            if scored:
+                position["score"] = last.score
+
+        return ret, position
+
+    def _get_terms_after_offset(self, terms, position, page_size):
+        offset = 0
+        if position:
+            offset = position["offset"]
+
+        ret = list(terms[offset:offset + page_size + 1])
+
+        position = None
+        if len(ret) > page_size:
+            ret = ret[:page_size]
+            position = {"offset": offset + page_size}
+
+        return ret, position
+
+
+def encode_cursor(position, scope=""):
+    """Returns an opaque cursor for <position> (a dictionary).
+    <scope> identifies the list of terms, e.g. the prefix and pattern.
+    """
+    return signing.dumps([scope, position], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, scope=""):
+    """Returns the position encoded in <cursor>, None if <cursor> is empty.
+    Raises SuspiciousOperation if the cursor is invalid
+    or was not issued for <scope>.
+    """
+    ret = None
+
+    if cursor:
+        try:
+            cursor_scope, ret = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise SuspiciousOperation("invalid pagination cursor")
+        if cursor_scope != scope:
+            raise SuspiciousOperation("pagination cursor from another search")
+
+    return ret
@@ -11,15 +11,27 @@
   }
 
   var init = function ($element, options) {
+    // page number: cursor returned by the server (see pagination.py)
+    var cursors = {}
     var settings = $.extend(
       {
         ajax: {
           data: function (params) {
-            return {
+            var ret = {
               term: params.term,
               page: params.page,
               prefix: $element.data('voc-prefix')
             }
+            if ($element.data('cursor-pagination')) {
+              ret.cursor = cursors[params.page || 1] || ''
+            }
+            return ret
+          },
+          processResults: function (data, params) {
+            if (data.pagination.more) {
+              cursors[(params.page || 1) + 1] = data.pagination.more
+            }
+            return data
           },
           // Used to avoid excessive amount of requests
           delay: 300
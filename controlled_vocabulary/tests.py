@@ -214,3 +214,1060 @@ class ControlledVocTestCase(TestCase):
 
         terms = manager.search("anatol")
         self.assertEqual(terms[0][0], "Hluw")
+
+    def test_search_list_ngram_index(self):
+        """base_list.search() should return the same terms, in the same
+        order, as a full scan of the list"""
+        from .vocabularies.dcmitype import VocabularyDCMIType
+
+        manager = VocabularyDCMIType()
+        scan = VocabularyDCMIType()
+        scan._get_candidate_positions = lambda pattern: range(
+            len(scan._searchable_terms)
+        )
+
+        for pattern in ["", "i", "im", "image", "IMAGE", "ice", "text", "xyz"]:
+            self.assertEqual(manager.search(pattern), scan.search(pattern))
+
+    def test_search_list_window(self):
+        """base_list.search() with limit and offset returns a slice
+        of the full results"""
+        manager = ControlledVocabularyConfig.get_vocabulary_manager("dcmitype")
+
+        for pattern in ["", "i", "image"]:
+            terms = manager.search(pattern)
+            for offset in [0, 1, 3]:
+                for limit in [0, 1, 2, 20]:
+                    self.assertEqual(
+                        manager.search(pattern, limit=limit, offset=offset),
+                        list(terms[offset:offset + limit]),
+                    )
+
+    def test_term_list_view_pages(self):
+        """The autocomplete returns the pages of the manager search results"""
+        from django.urls import reverse
+
+        manager = ControlledVocabularyConfig.get_vocabulary_manager("dcmitype")
+        labels = [term[1] for term in manager.search("e")]
+        self.assertGreater(len(labels), 10)
+
+        url = reverse("controlled_terms")
+        res = self.client.get(url, {"prefix": "dcmitype", "term": "e"}).json()
+        self.assertEqual([r["text"] for r in res["results"]], labels[:10])
+        self.assertTrue(res["pagination"]["more"])
+
+        res = self.client.get(
+            url, {"prefix": "dcmitype", "term": "e", "page": 2}
+        ).json()
+        self.assertEqual([r["text"] for r in res["results"]], labels[10:20])
+        self.assertFalse(res["pagination"]["more"])
+
+    def test_search_window_legacy_plugin(self):
+        """Managers which search() doesn't accept limit and offset
+        are still supported"""
+        from asgiref.sync import async_to_sync
+
+        from .views import SearchResults
+        from .vocabularies.base import VocabularyBase, search_window
+
+        class VocabularyLegacy(VocabularyBase):
+            prefix = "test-legacy"
+
+            def search(self, pattern):
+                return [[str(i), "Term {}".format(i)] for i in range(25)]
+
+        manager = VocabularyLegacy()
+        self.assertEqual(
+            search_window(manager, "term", limit=10, offset=20),
+            manager.search("term")[20:],
+        )
+        self.assertEqual(
+            async_to_sync(manager.asearch)("term", limit=2),
+            manager.search("term")[:2],
+        )
+        results = SearchResults(manager, "term", lambda terms: terms)
+        self.assertEqual(len(results), 25)
+        self.assertEqual(results[10:12], manager.search("term")[10:12])
+
+    def test_term_list_view_lazy_results(self):
+        """The autocomplete only converts the terms of the requested page"""
+        from .views import SearchResults
+
+        manager = ControlledVocabularyConfig.get_vocabulary_manager("dcmitype")
+        for pattern in ["", "e", "IMAGE", "xyz"]:
+            self.assertEqual(manager.count(pattern), len(manager.search(pattern)))
+
+        converted = []
+
+        def convert(terms):
+            converted.extend(terms)
+            return [term[1] for term in terms]
+
+        labels = [term[1] for term in manager.search("e")]
+        results = SearchResults(manager, "e", convert)
+        self.assertEqual(len(results), len(labels))
+        self.assertEqual(converted, [])
+        self.assertEqual(results[10:20], labels[10:20])
+        self.assertEqual(len(converted), len(labels[10:20]))
+        self.assertEqual([results[0], results[-1]], [labels[0], labels[-1]])
+        self.assertEqual(list(results), labels)
+
+        # a manager which can't count without searching is only called once
+        from .vocabularies.base_http import VocabularyHTTP
+
+        class VocabularyTestHTTP(VocabularyHTTP):
+            prefix = "test-lazy-http"
+            source = {"url": "", "cache_ttl": 0, "negative_cache_ttl": 0}
+            calls = []
+
+            def _search_remote(self, pattern):
+                self.calls.append(pattern)
+                return [[str(i), "Term {}".format(i)] for i in range(25)]
+
+        manager = VocabularyTestHTTP()
+        results = SearchResults(manager, "term", lambda terms: terms)
+        self.assertEqual(len(results), 25)
+        self.assertEqual(results[10:12], [["10", "Term 10"], ["11", "Term 11"]])
+        self.assertEqual(manager.calls, ["term"])
+
+    def test_search_csv_index(self):
+        """base_csv.search() reads from a binary index built next to the CSV
+        and should return the same terms as base_list.search()"""
+        import csv
+        import os
+        import tempfile
+
+        from django.test import override_settings
+
+        from .vocabularies.base_csv import VocabularyBaseCSV
+        from .vocabularies.dcmitype import VocabularyDCMIType
+
+        class VocabularyTestCSV(VocabularyBaseCSV):
+            prefix = "test-csv"
+            source = {"url": "dcmitype.csv"}
+
+            def _get_terms_from_csv_line(self, line):
+                return [line]
+
+        expected = VocabularyDCMIType()
+        terms = expected._get_searchable_terms()
+
+        with tempfile.TemporaryDirectory() as root:
+            with override_settings(CONTROLLED_VOCABULARY_DATA_ROOT=root):
+                with open(os.path.join(root, "dcmitype.csv"), "w") as fh:
+                    writer = csv.writer(fh)
+                    writer.writerow(["termid", "label", "description"])
+                    for term in terms:
+                        writer.writerow((list(term) + [""])[:3])
+
+                manager = VocabularyTestCSV()
+                for pattern in ["i", "im", "image", "StillImage", "xyz"]:
+                    self.assertEqual(
+                        manager.search(pattern), expected.search(pattern)
+                    )
+
+                self.assertTrue(
+                    os.path.exists(os.path.join(root, "dcmitype.csv.idx"))
+                )
+
+    def test_search_http_cache(self):
+        """base_http.search() caches the remote results by normalised pattern"""
+        from .vocabularies.base_http import VocabularyHTTP
+        from .vocabularies.cache import get_search_cache
+
+        class VocabularyTestHTTP(VocabularyHTTP):
+            prefix = "test-http"
+            source = {"url": "", "cache_ttl": 60}
+            calls = []
+
+            def _search_remote(self, pattern):
+                self.calls.append(pattern)
+                return [["Q1", pattern], ["Q2", pattern + " 2"]]
+
+        cache = get_search_cache()
+        cache.clear()
+
+        manager = VocabularyTestHTTP()
+        terms = manager.search("Paris")
+        self.assertEqual(manager.search(" paris "), terms)
+        self.assertEqual(manager.search("paris", limit=1, offset=1), terms[1:])
+        self.assertEqual(manager.calls, ["Paris"])
+        self.assertEqual(
+            cache.get_stats()["test-http"], {"hits": 2, "misses": 1}
+        )
+
+        manager.source = {"url": "", "cache_ttl": 0}
+        manager.search("London")
+        manager.search("London")
+        self.assertEqual(manager.calls, ["Paris", "London", "London"])
+
+    def test_fetch_shared_client(self):
+        """fetch() uses a shared http client and returns None on failure"""
+        from django.test import override_settings
+
+        from .vocabularies import base
+        from .vocabularies.base import fetch, get_http_client
+
+        # a client without retries (and their backoff)
+        base._http_client = None
+        try:
+            with override_settings(CONTROLLED_VOCABULARY_HTTP_RETRIES=0):
+                self.assertIs(get_http_client(), get_http_client())
+                # nothing listens on that port
+                self.assertIsNone(fetch("http://127.0.0.1:9/"))
+        finally:
+            base._http_client = None
+
+    def test_fetch_redirect(self):
+        """fetch() and afetch() follow the redirections"""
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        from asgiref.sync import async_to_sync
+
+        from .vocabularies.base import afetch, fetch, get_async_http_client
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/old":
+                    self.send_response(301)
+                    self.send_header("Location", "/new")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/old".format(server.server_address[1])
+
+        try:
+            self.assertEqual(fetch(url), b"ok")
+
+            async def afetch_client():
+                return await afetch(url), get_async_http_client()
+
+            content, client = async_to_sync(afetch_client)()
+            self.assertEqual(content, b"ok")
+            # closed with its event loop
+            self.assertTrue(client.is_closed)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_term_list_view_async(self):
+        """The async autocomplete returns the same results as the sync one"""
+        from django.urls import reverse
+
+        for params in [
+            {"prefix": "dcmitype", "term": "e"},
+            {"prefix": "dcmitype", "term": "e", "page": 2},
+            {"prefix": "dcmitype", "term": "image"},
+        ]:
+            self.assertEqual(
+                self.client.get(reverse("controlled_terms_async"), params).json(),
+                self.client.get(reverse("controlled_terms"), params).json(),
+            )
+
+        res = self.client.get(reverse("controlled_terms_async"), {"prefix": "?"})
+        self.assertEqual(res.status_code, 404)
+
+    def test_search_federated(self):
+        """search_federated() merges the results of several vocabularies
+        and ignores the ones which miss the deadline"""
+        import time
+
+        from django.apps import apps
+
+        from .utils import search_federated
+        from .vocabularies.base_list import VocabularyBaseList
+
+        class VocabularySlow(VocabularyBaseList):
+            prefix = "test-slow"
+
+            def search(self, pattern, limit=None, offset=0):
+                time.sleep(0.5)
+                return [["slow", "Slow image"]]
+
+        local = ControlledVocabulary.objects.create(prefix="test-local", label="L")
+        ControlledTerm.objects.create(vocabulary=local, termid="1", label="images")
+        ControlledVocabulary.objects.create(prefix="test-slow", label="S")
+
+        managers = apps.get_app_config("controlled_vocabulary").vocabulary_managers
+        managers["test-slow"] = VocabularySlow()
+        try:
+            res = search_federated(
+                ["dcmitype", "test-local", "test-slow"], "image", deadline=0.2
+            )
+        finally:
+            del managers["test-slow"]
+
+        expected = [
+            ("dcmitype", "Image"),
+            ("test-local", "images"),
+            ("dcmitype", "Moving Image"),
+            ("dcmitype", "Still Image"),
+        ]
+        self.assertEqual([(record.prefix, term[1]) for record, term in res], expected)
+
+        from django.urls import reverse
+
+        res = self.client.get(
+            reverse("controlled_terms_federated"),
+            {"vocabularies": "dcmitype,test-local", "term": "image"},
+        ).json()
+        self.assertEqual([(r["prefix"], r["text"]) for r in res["results"]], expected)
+
+    def test_search_http_single_flight(self):
+        """Concurrent base_http.search() for the same pattern
+        share a single remote request"""
+        import threading
+        import time
+
+        from .vocabularies.base_http import VocabularyHTTP
+        from .vocabularies.singleflight import search_flights
+
+        class VocabularyTestHTTP(VocabularyHTTP):
+            prefix = "test-flight"
+            source = {"url": "", "cache_ttl": 0}
+            calls = []
+
+            def _search_remote(self, pattern):
+                self.calls.append(pattern)
+                time.sleep(0.2)
+                return [["Q1", pattern]]
+
+        manager = VocabularyTestHTTP()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(manager.search("Rome")))
+            for i in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(manager.calls, ["Rome"])
+        self.assertEqual(results, [[["Q1", "Rome"]]] * 5)
+        self.assertEqual(
+            search_flights.get_stats()["test-flight"],
+            {"upstream": 1, "coalesced": 4},
+        )
+
+    def test_search_http_circuit_breaker(self):
+        """base_http.search() returns no terms when the remote service fails,
+        and stops calling it after repeated failures"""
+        import time
+
+        from .vocabularies.base_http import VocabularyHTTP
+        from .vocabularies.breaker import CLOSED, OPEN, CircuitBreaker
+
+        class VocabularyTestHTTP(VocabularyHTTP):
+            prefix = "test-breaker"
+            source = {"url": "", "negative_cache_ttl": 0}
+            calls = []
+            content = None
+
+            def _search_remote(self, pattern):
+                self.calls.append(pattern)
+                return self._parse_content(self.content)
+
+        manager = VocabularyTestHTTP()
+        manager._circuit_breaker = CircuitBreaker(
+            failure_rate=0.5, min_calls=3, window=10, reset_timeout=0.1
+        )
+
+        for i in range(5):
+            self.assertEqual(manager.search("Oxford"), [])
+        self.assertEqual(len(manager.calls), 3)
+        self.assertEqual(manager._circuit_breaker.state, OPEN)
+
+        # half-open: a successful probe closes the circuit
+        time.sleep(0.1)
+        manager.content = b'{"response": {"docs": []}}'
+        manager.search("Oxford")
+        self.assertEqual(len(manager.calls), 4)
+        self.assertEqual(manager._circuit_breaker.state, CLOSED)
+
+        # an unexpected response during the probe is a failure,
+        # the next probe is still allowed
+        manager.content = None
+        for i in range(3):
+            manager.search("Leeds")
+        self.assertEqual(manager._circuit_breaker.state, OPEN)
+        time.sleep(0.1)
+        manager.content = b'{"unexpected": []}'
+        self.assertEqual(manager.search("Leeds"), [])
+        self.assertEqual(manager._circuit_breaker.state, OPEN)
+        time.sleep(0.1)
+        manager.content = b'{"response": {"docs": []}}'
+        manager.search("Leeds")
+        self.assertEqual(manager._circuit_breaker.state, CLOSED)
+        manager.calls.clear()
+
+        # empty results are cached briefly
+        manager.source = {"url": "", "negative_cache_ttl": 60}
+        manager.search("Cambridge")
+        manager.search("Cambridge")
+        self.assertEqual(len(manager.calls), 1)
+
+    def test_fetch_to_file(self):
+        """fetch_to_file() streams, resumes and skips unchanged downloads"""
+        import os
+        import tempfile
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        from .vocabularies.base import fetch_to_file
+
+        content = b"termid,label\n" + b"".join(
+            "t{0},Term {0}\n".format(i).encode() for i in range(10000)
+        )
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(dict(self.headers))
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                start = 0
+                if self.headers.get("If-Range") == '"v1"':
+                    start = int(self.headers["Range"][6:-1])
+                    self.send_response(206)
+                else:
+                    self.send_response(200)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(content) - start))
+                self.end_headers()
+                self.wfile.write(content[start:])
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/terms.csv".format(server.server_address[1])
+
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                path = os.path.join(root, "terms.csv")
+
+                res = fetch_to_file(url, path)
+                self.assertEqual(res["status"], "downloaded")
+                self.assertEqual(res["etag"], '"v1"')
+                with open(path, "rb") as fh:
+                    self.assertEqual(fh.read(), content)
+
+                res = fetch_to_file(url, path, etag=res["etag"])
+                self.assertEqual(res["status"], "not modified")
+                self.assertEqual(res["size"], len(content))
+
+                # resume an interrupted download
+                os.remove(path)
+                with open(path + ".part", "wb") as fh:
+                    fh.write(content[:1000])
+                with open(path + ".part.json", "w") as fh:
+                    fh.write('{"etag": "\\"v1\\""}')
+                res = fetch_to_file(url, path)
+                self.assertEqual(res["status"], "downloaded")
+                self.assertEqual(requests[-1]["Range"], "bytes=1000-")
+                with open(path, "rb") as fh:
+                    self.assertEqual(fh.read(), content)
+                self.assertEqual(sorted(os.listdir(root)), ["terms.csv"])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_vocab_fetch_jobs(self):
+        """vocab fetch -j downloads the vocabularies in parallel
+        and exits with an error if one of them fails"""
+        import threading
+        from io import StringIO
+
+        from django.apps import apps
+
+        from .vocabularies.base_csv import VocabularyBaseCSV
+
+        # fails unless both downloads are running at the same time
+        barrier = threading.Barrier(2, timeout=5)
+
+        class VocabularyFetched(VocabularyBaseCSV):
+            prefix = "test-fetched"
+
+            def download(self, overwrite=False):
+                barrier.wait()
+                return ["http://localhost/terms.csv", "terms.csv", 2048, True]
+
+        class VocabularyBroken(VocabularyBaseCSV):
+            prefix = "test-broken"
+
+            def download(self, overwrite=False):
+                barrier.wait()
+                raise OSError("connection refused")
+
+        managers = apps.get_app_config("controlled_vocabulary").vocabulary_managers
+        managers["test-fetched"] = VocabularyFetched()
+        managers["test-broken"] = VocabularyBroken()
+        out = StringIO()
+        try:
+            with self.assertRaises(SystemExit):
+                management.call_command(
+                    "vocab", "fetch", f="test-fetched,test-broken", jobs=2, stdout=out
+                )
+        finally:
+            del managers["test-fetched"]
+            del managers["test-broken"]
+
+        out = out.getvalue()
+        self.assertIn("downloaded in", out)
+        self.assertIn("connection refused", out)
+
+    def test_csv_index_fingerprint(self):
+        """base_csv rebuilds its index only if the content of the CSV
+        or the parser_version change"""
+        import os
+        import tempfile
+
+        from django.test import override_settings
+
+        from .vocabularies.base_csv import VocabularyBaseCSV
+
+        class VocabularyTestCSV(VocabularyBaseCSV):
+            prefix = "test-csv"
+            source = {"url": "terms.csv"}
+
+            def _get_terms_from_csv_line(self, line):
+                return [line]
+
+        with tempfile.TemporaryDirectory() as root:
+            with override_settings(CONTROLLED_VOCABULARY_DATA_ROOT=root):
+                path = os.path.join(root, "terms.csv")
+                with open(path, "w") as fh:
+                    fh.write("termid,label\nt1,Term 1\n")
+
+                manager = VocabularyTestCSV()
+                self.assertTrue(manager.is_index_stale())
+                manager.build_index()
+                self.assertFalse(manager.is_index_stale())
+
+                # same content, different modification time
+                os.utime(path, (1, 1))
+                self.assertFalse(manager.is_index_stale())
+
+                manager.parser_version = 2
+                self.assertTrue(manager.is_index_stale())
+                manager.build_index()
+                self.assertFalse(manager.is_index_stale())
+
+                with open(path, "a") as fh:
+                    fh.write("t2,Term 2\n")
+                self.assertTrue(manager.is_index_stale())
+
+                # the index can't be written (e.g. read-only data root)
+                class VocabularyReadOnlyCSV(VocabularyTestCSV):
+                    def _get_index_path(self):
+                        return os.path.join(root, "missing", "terms.csv.idx")
+
+                manager = VocabularyReadOnlyCSV()
+                self.assertEqual(
+                    [t[0] for t in manager.search("term")], ["t1", "t2"]
+                )
+
+    def test_sync_vocabulary_records(self):
+        """At startup, the vocabulary records are only written
+        if the metadata of the managers has changed"""
+        import json
+        import tempfile
+
+        from django.apps import apps
+        from django.test import override_settings
+
+        from .vocabularies import registry
+
+        app = apps.get_app_config("controlled_vocabulary")
+
+        # a separate data root for the manifest and fingerprint
+        with tempfile.TemporaryDirectory() as root:
+            try:
+                with override_settings(CONTROLLED_VOCABULARY_DATA_ROOT=root):
+                    self.assertEqual(app.sync_vocabulary_records("always"), "synced")
+
+                    with self.assertNumQueries(0):
+                        self.assertEqual(
+                            app.sync_vocabulary_records("auto"), "unchanged"
+                        )
+                        self.assertEqual(
+                            app.sync_vocabulary_records("never"), "skipped"
+                        )
+
+                    # the metadata of the managers is read from the manifest
+                    path = registry._get_manifest_path()
+                    with open(path) as fh:
+                        manifest = json.load(fh)
+                    with open(path, "w") as fh:
+                        module = "controlled_vocabulary.vocabularies.dcmitype"
+                        dcmitype = manifest[module]["managers"][0]
+                        dcmitype["label"] = "DCMI Types (changed)"
+                        json.dump(manifest, fh)
+
+                    self.assertEqual(app.sync_vocabulary_records("auto"), "synced")
+                    self.assertEqual(
+                        ControlledVocabulary.objects.get(prefix="dcmitype").label,
+                        "DCMI Types (changed)",
+                    )
+            finally:
+                # reloads the managers from the project data root
+                app.sync_vocabulary_records("never")
+
+    def test_vocabulary_registry(self):
+        """The registry imports a vocabulary module only when
+        one of its managers is requested"""
+        import os
+        import sys
+        import tempfile
+
+        from django.test import override_settings
+
+        from .vocabularies.registry import VocabularyRegistry
+
+        plugin = """from controlled_vocabulary.vocabularies.dcmitype import *
+
+
+class VocabularyPlugin(VocabularyDCMIType):
+    prefix = "test-plugin"
+    label = "{}"
+"""
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "cv_test_plugin.py")
+            with open(path, "w") as fh:
+                fh.write(plugin.format("Plugin"))
+            sys.path.insert(0, root)
+            try:
+                with override_settings(CONTROLLED_VOCABULARY_DATA_ROOT=root):
+                    VocabularyRegistry(["cv_test_plugin"])
+                    del sys.modules["cv_test_plugin"]
+
+                    registry = VocabularyRegistry(["cv_test_plugin"])
+                    self.assertEqual(
+                        sorted(registry), ["dcmitype", "test-plugin"]
+                    )
+                    self.assertNotIn("cv_test_plugin", sys.modules)
+
+                    manager = registry["test-plugin"]
+                    self.assertEqual(manager.label, "Plugin")
+                    self.assertIs(registry["test-plugin"], manager)
+
+                    # the manifest is refreshed when the module changes
+                    with open(path, "w") as fh:
+                        fh.write(plugin.format("Plugin v2"))
+                    os.utime(path, (1, 1))
+                    del sys.modules["cv_test_plugin"]
+                    registry = VocabularyRegistry(["cv_test_plugin"])
+                    self.assertIn(
+                        {
+                            "prefix": "test-plugin",
+                            "label": "Plugin v2",
+                            "base_url": manager.base_url,
+                            "description": manager.description,
+                            "concept": manager.concept,
+                        },
+                        registry.get_metadata(),
+                    )
+            finally:
+                sys.path.remove(root)
+                sys.modules.pop("cv_test_plugin", None)
+
+    def test_materialize_vocabulary(self):
+        """materialize_vocabulary() copies all the terms of a manager
+        into the database, and only updates the changed ones"""
+        from .utils import materialize_vocabulary
+        from .vocabularies.dcmitype import VocabularyDCMIType
+
+        terms = VocabularyDCMIType()._get_searchable_terms()
+
+        stats = materialize_vocabulary("dcmitype", batch_size=5)
+        self.assertEqual(
+            [stats["terms"], stats["created"], stats["updated"]],
+            [len(terms), len(terms), 0],
+        )
+
+        records = ControlledTerm.objects.filter(vocabulary__prefix="dcmitype")
+        self.assertEqual(
+            sorted([r.termid, r.label] for r in records),
+            sorted([t[0], t[1]] for t in terms),
+        )
+
+        records.filter(termid="Image").update(label="Picture")
+        stats = materialize_vocabulary("dcmitype", batch_size=5)
+        self.assertEqual([stats["created"], stats["updated"]], [0, 1])
+        self.assertEqual(records.get(termid="Image").label, "Image")
+
+    def test_search_term_many(self):
+        """search_term_many() returns the same terms as search_term()
+        with a constant number of queries"""
+        from .utils import search_term, search_term_many
+
+        vocabulary = ControlledVocabulary.objects.get(prefix="dcmitype")
+        existing = ControlledTerm.objects.create(
+            vocabulary=vocabulary, termid="Image", label="Image"
+        )
+        patterns = ["image", "IMAGE", "still image", "Sound", "", "xyz", "sound"]
+
+        # vocabulary, DB search, then get_or_create_many():
+        # existing terms, insert and fetch the new terms
+        with self.assertNumQueries(5):
+            res = search_term_many("dcmitype", patterns, exact=True)
+
+        self.assertEqual(res[0], existing)
+        self.assertEqual(res[1], existing)
+        self.assertEqual(
+            [r and r.termid for r in res[2:]],
+            ["StillImage", "Sound", None, None, "Sound"],
+        )
+        self.assertEqual(
+            ControlledTerm.objects.filter(vocabulary=vocabulary).count(), 3
+        )
+
+        for pattern, term in zip(patterns, res):
+            if pattern:
+                self.assertEqual(search_term("dcmitype", pattern, exact=True), term)
+
+        # non-ASCII patterns are lowered by the database, like search_term()
+        local = ControlledVocabulary.objects.create(prefix="test-many", label="M")
+        ControlledTerm.objects.create(vocabulary=local, termid="ie", label="Éire")
+        for pattern in ["Éire", "ÉIRE", "IE"]:
+            self.assertEqual(
+                search_term_many("test-many", [pattern]),
+                [search_term("test-many", pattern)],
+            )
+        self.assertIsNotNone(search_term_many("test-many", ["Éire"])[0])
+
+    def test_terms_create_from_strings(self):
+        """terms_create_from_strings() (used by ControlledTermsWidget)
+        gets or creates all the submitted terms with a constant number
+        of queries, in the submitted order"""
+        from .models import terms_create_from_strings
+
+        vocabulary = ControlledVocabulary.objects.get(prefix="dcmitype")
+        existing = ControlledTerm.objects.create(
+            vocabulary=vocabulary, termid="Image", label="Image"
+        )
+
+        values = [
+            "{}::Sound::Sound::A+sound".format(vocabulary.id),
+            str(existing.id),
+            "{}::Image::Image".format(vocabulary.id),
+            "{}::Text::Text".format(vocabulary.id),
+        ]
+        # existing terms, insert and fetch the new terms
+        with self.assertNumQueries(3):
+            res = terms_create_from_strings(values)
+
+        terms = ControlledTerm.objects.in_bulk()
+        self.assertEqual(
+            [terms[int(pk)].termid for pk in res], ["Sound", "Image", "Image", "Text"]
+        )
+        self.assertEqual(terms[res[0]].description, "A sound")
+
+        # a row skipped by the bulk insert (e.g. SQLite ignores
+        # NOT NULL violations) raises the error instead of returning None
+        from django.db import IntegrityError, transaction
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ControlledTerm.get_or_create_many([[vocabulary.id, "Event", None, ""]])
+
+    def test_widget_vocabularies_cache(self):
+        """Rendering many autocomplete widgets only queries
+        the vocabularies once"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from .models import clear_vocabularies_cache
+
+        field = ControlledVocabulary._meta.get_field("concept")
+
+        def render(count):
+            clear_vocabularies_cache()
+            with CaptureQueriesContext(connection) as queries:
+                for i in range(count):
+                    field.formfield().widget.render("concept", None)
+            return len(queries)
+
+        self.assertEqual(render(10), render(1))
+
+        # the cache is cleared when a vocabulary changes
+        field.formfield().widget.render("concept", None)
+        ControlledVocabulary.objects.filter(prefix="wikidata").first().save()
+        with self.assertNumQueries(1):
+            field.formfield().widget.render("concept", None)
+
+        # the cache is bounded, e.g. ?vocabularies=... from any client
+        from . import models
+
+        for i in range(models.VOCABULARIES_CACHE_SIZE + 10):
+            models.filter_vocabularies(["test-{}".format(i)])
+        self.assertEqual(
+            len(models._vocabularies_cache), models.VOCABULARIES_CACHE_SIZE
+        )
+        self.assertNotIn(("test-0",), models._vocabularies_cache)
+
+    def test_term_vocabulary_cache(self):
+        """Listing terms with their uri doesn't query the vocabulary
+        of each term"""
+        from .models import clear_vocabularies_cache
+
+        vocabulary = ControlledVocabulary.objects.get(prefix="dcmitype")
+        for i in range(10):
+            ControlledTerm.objects.create(
+                vocabulary=vocabulary, termid="t{}".format(i), label=str(i)
+            )
+        clear_vocabularies_cache()
+
+        def get_uris(terms):
+            return [[str(t), t.uri, t.get_absolute_id()] for t in terms]
+
+        # the vocabulary is selected by the default manager
+        with self.assertNumQueries(1):
+            expected = get_uris(ControlledTerm.objects.all())
+
+        # or read from the cache
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                get_uris(ControlledTerm.objects.select_related(None)), expected
+            )
+        with self.assertNumQueries(1):
+            get_uris(ControlledTerm.objects.select_related(None))
+
+        vocabulary.base_url = "https://example.com/dcmitype/"
+        vocabulary.save()
+        term = ControlledTerm.objects.select_related(None).get(termid="t0")
+        self.assertEqual(term.uri, "https://example.com/dcmitype/t0")
+
+        # no join if the vocabulary is deferred or the terms locked
+        vocabulary_table = ControlledVocabulary._meta.db_table
+        for terms in [
+            ControlledTerm.objects.only("label"),
+            ControlledTerm.objects.defer("vocabulary"),
+            ControlledTerm.objects.select_for_update(),
+        ]:
+            self.assertNotIn(vocabulary_table, str(terms.query))
+        self.assertEqual(
+            [t.label for t in ControlledTerm.objects.only("label").filter(termid="t1")],
+            ["1"],
+        )
+        self.assertEqual(
+            str(ControlledTerm.objects.defer("vocabulary").get(termid="t1")),
+            "1 (dcmitype)",
+        )
+        self.assertIn(
+            vocabulary_table,
+            str(ControlledTerm.objects.only("label", "vocabulary").query),
+        )
+
+    def test_search_term_lower_index(self):
+        """search_term() looks up the DB with LOWER(), which is indexed"""
+        from django.db import connection
+
+        from .utils import _filter_terms_iexact
+
+        table = ControlledTerm._meta.db_table
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        self.assertIn("controlled_vocabulary_term_label_lower", constraints)
+
+        vocabulary = ControlledVocabulary.objects.get(prefix="dcmitype")
+        term = ControlledTerm.objects.create(
+            vocabulary=vocabulary, termid="StillImage", label="Still Image"
+        )
+        terms = ControlledTerm.objects.filter(vocabulary=vocabulary)
+        for pattern in ["stillimage", "STILL IMAGE"]:
+            self.assertEqual(list(_filter_terms_iexact(terms, pattern)), [term])
+
+    def test_db_search_backends(self):
+        """The DB search backends rank the terms of local vocabularies
+        like base_list.search()"""
+        from django.db.models import Q
+
+        from .db_search import (
+            SQLITE_FTS_TABLE,
+            DBSearchBackend,
+            SQLiteSearchBackend,
+            _get_default_backend_class,
+            _table_exists,
+        )
+        from .vocabularies.dcmitype import VocabularyDCMIType
+
+        # the FTS5 table is only created by SQLite 3.34+ with FTS5
+        fts = _table_exists(SQLITE_FTS_TABLE)
+
+        manager = VocabularyDCMIType()
+        local = ControlledVocabulary.objects.create(prefix="test-local", label="L")
+        for term in manager._get_searchable_terms():
+            ControlledTerm.objects.create(
+                vocabulary=local,
+                termid=term[0],
+                label=term[1],
+                description=(list(term) + [""])[2],
+            )
+
+        backends = [DBSearchBackend()]
+        if fts:
+            backends.append(SQLiteSearchBackend())
+        for backend in backends:
+            for pattern in ["i", "im", "image", "IMAGE", "Text", "xyz", ""]:
+                self.assertEqual(
+                    [
+                        [t.termid, t.label, getattr(t, "score", 0)]
+                        for t in backend.search(local, pattern)
+                    ],
+                    [
+                        [t[0], t[1], t[3] if pattern else 0]
+                        for t in manager.search(pattern)
+                    ],
+                )
+
+        # terms selected by the label condition but without points
+        # (e.g. by a full-text index) are not returned
+        class AllTermsBackend(DBSearchBackend):
+            def _get_label_condition(self, pattern):
+                return ~Q(pk=None)
+
+        self.assertEqual(
+            [t.termid for t in AllTermsBackend().search(local, "image")],
+            [t[0] for t in manager.search("image")],
+        )
+
+        # icontains on PostgreSQL, the tsvector backend is opt-in
+        self.assertIs(_get_default_backend_class("postgresql"), DBSearchBackend)
+
+        # the full-text index follows the changes of the terms
+        if fts:
+            backend = SQLiteSearchBackend()
+            ControlledTerm.objects.filter(termid="Sound").update(label="Audio")
+            self.assertEqual(
+                [t.termid for t in backend.search(local, "audio")], ["Sound"]
+            )
+            ControlledTerm.objects.filter(termid="Sound").delete()
+            self.assertEqual(list(backend.search(local, "audio")), [])
+
+    def test_filter_data(self):
+        """The terms can be filtered by metadata in the database"""
+        from importlib import import_module
+
+        migration = import_module(
+            "controlled_vocabulary.migrations.0007_controlledterm_data_json"
+        )
+
+        vocabulary = ControlledVocabulary.objects.create(prefix="test-data", label="D")
+        terms = [
+            ControlledTerm.objects.create(
+                vocabulary=vocabulary, termid=str(i), label=str(i), data=data
+            )
+            for i, data in enumerate(
+                [
+                    {"country": "fr", "year": 1950},
+                    {"country": "fr", "year": 1850},
+                    {"country": "uk"},
+                    None,
+                ]
+            )
+        ]
+
+        filtered = ControlledTerm.objects.filter(vocabulary=vocabulary)
+        self.assertEqual(list(filtered.filter_data(country="fr")), terms[:2])
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [
+                    str(term)
+                    for term in ControlledTerm.objects.filter_data(
+                        country="fr", year__gte=1900
+                    )
+                ],
+                ["0 (test-data)"],
+            )
+
+        # the indexes of the keys are only created on PostgreSQL
+        from io import StringIO
+
+        from .data_indexes import get_data_index_name
+
+        self.assertEqual(
+            get_data_index_name("Date of birth"),
+            "controlled_vocabulary_term_data_date_of_birth",
+        )
+        out = StringIO()
+        management.call_command("vocab", "index_data", stdout=out)
+        self.assertIn("only supported on PostgreSQL", out.getvalue())
+
+        # the text stored before the JSONField is converted to valid JSON
+        for text, expected in [
+            ['{"a": 1}', '{"a": 1}'],
+            ["abc", '"abc"'],
+            [" ", None],
+            ["NaN", '"NaN"'],
+        ]:
+            self.assertEqual(migration._get_valid_json(text), expected)
+
+    def test_term_list_view_cursor(self):
+        """The autocomplete can return the next pages by cursor"""
+        from django.urls import reverse
+
+        from .db_search import DBSearchBackend
+
+        manager = ControlledVocabularyConfig.get_vocabulary_manager("dcmitype")
+        local = ControlledVocabulary.objects.create(prefix="test-cursor", label="C")
+        for term in manager._get_searchable_terms():
+            for i in range(2):
+                ControlledTerm.objects.create(
+                    vocabulary=local, termid=term[0] + str(i), label=term[1]
+                )
+
+        def get_all_pages(prefix, pattern):
+            ret = []
+            cursor = ""
+            while cursor is not False:
+                res = self.client.get(
+                    reverse("controlled_terms"),
+                    {"prefix": prefix, "term": pattern, "cursor": cursor},
+                ).json()
+                self.assertLessEqual(len(res["results"]), 10)
+                ret.extend([r["termid"] for r in res["results"]])
+                cursor = res["pagination"]["more"]
+            return ret
+
+        for pattern in ["e", ""]:
+            self.assertEqual(
+                get_all_pages("dcmitype", pattern),
+                [term[0] for term in manager.search(pattern)],
+            )
+            terms = DBSearchBackend().search(local, pattern)
+            self.assertEqual(
+                get_all_pages("test-cursor", pattern), [t.termid for t in terms]
+            )
+
+        # no count, no offset
+        res = self.client.get(
+            reverse("controlled_terms"), {"prefix": "test-cursor", "cursor": ""}
+        ).json()
+        with self.assertNumQueries(2):
+            self.client.get(
+                reverse("controlled_terms"),
+                {"prefix": "test-cursor", "cursor": res["pagination"]["more"]},
+            )
+
+        # cursor from another search
+        res = self.client.get(
+            reverse("controlled_terms"),
+            {"prefix": "test-cursor", "term": "e", "cursor": res["pagination"]["more"]},
+        )
+        self.assertEqual(res.status_code, 400)
@@ -4,9 +4,24 @@ from . import views
 
 urlpatterns = [
     path("terms/", views.TermListView.as_view(), name="controlled_terms"),
+    path(
+        "terms/federated/",
+        views.FederatedTermListView.as_view(),
+        name="controlled_terms_federated",
+    ),
     path(
         "<slug:prefix>/terms/",
         views.TermListView.as_view(),
         name="controlled_vocabulary_terms",
     ),
+    path(
+        "terms/async/",
+        views.term_list_async,
+        name="controlled_terms_async",
+    ),
+    path(
+        "<slug:prefix>/terms/async/",
+        views.term_list_async,
+        name="controlled_vocabulary_terms_async",
+    ),
 ]
@@ -1,8 +1,23 @@
 import re
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
 
 from .apps import ControlledVocabularyConfig
-from .models import ControlledTerm, ControlledVocabulary
+from .models import (
+    LENGTH_LABEL,
+    ControlledTerm,
+    ControlledVocabulary,
+    filter_vocabularies,
+)
+from .settings import get_var
+from .vocabularies.base import search_window
+
+_federated_executor = None
+_federated_executor_lock = threading.Lock()
+_bulk_executor = None
+_bulk_executor_lock = threading.Lock()
 
 
 def search_term(
@@ -30,10 +45,8 @@ def search_term(
     """
 
     # try the DB first
-    from django.db.models import Q
-
-    ret = ControlledTerm.objects.filter(
-        Q(termid__iexact=pattern) | Q(label__iexact=pattern), vocabulary__prefix=prefix
+    ret = _filter_terms_iexact(
+        ControlledTerm.objects.filter(vocabulary__prefix=prefix), pattern
     ).first()
     if ret:
         return ret
@@ -45,28 +58,165 @@ def search_term(
     )
 
     pattern = pattern.lower()
-    terms = manager.search(pattern)
-
-    if terms:
-        term = None
-
-        for t in terms:
-            if exact:
-                if t[1].lower() == pattern or t[0].lower() == pattern:
-                    term = t
-                    break
-            else:
-                if pattern in t[1].lower() or pattern in t[0].lower():
-                    term = t
-                    break
-
-        if term:
-            desc = term[2] if len(term) > 2 else ""
-            ret, _ = ControlledTerm.objects.get_or_create(
-                vocabulary=vocabulary,
-                termid=term[0].strip(),
-                defaults={"label": term[1], "description": desc},
+    term = _select_term(manager.search(pattern), pattern, exact)
+
+    if term:
+        desc = term[2] if len(term) > 2 else ""
+        ret, _ = ControlledTerm.objects.get_or_create(
+            vocabulary=vocabulary,
+            termid=term[0].strip(),
+            defaults={"label": term[1], "description": desc},
+        )
+
+    return ret
+
+
+def _filter_terms_iexact(terms, pattern):
+    """Returns the terms which termid or label is equal to <pattern>,
+    ignoring case.
+    Same as Q(termid__iexact=pattern) | Q(label__iexact=pattern)
+    but uses the LOWER() indexes, see migration 0005.
+    """
+    from django.db.models import Q, Value
+    from django.db.models.functions import Lower
+
+    pattern = Lower(Value(pattern))
+
+    return terms.annotate(
+        termid_lower=Lower("termid"), label_lower=Lower("label")
+    ).filter(Q(termid_lower=pattern) | Q(label_lower=pattern))
+
+
+def search_term_many(
+    prefix: str, patterns: List[str], exact: bool = False
+) -> List[Optional["ControlledTerm"]]:
+    """Returns a list with the `ControlledTerm` matching each pattern
+    in <patterns> (or None), for the `ControlledVocabulary` with the
+    given `prefix`. Same as calling search_term() for each pattern,
+    but suitable for large lists of patterns (e.g. a data import):
+
+    Identical patterns (ignoring case) are only searched once.
+    The terms already in the DB are found with one query per batch of
+    settings.CONTROLLED_VOCABULARY_BULK_BATCH_SIZE patterns
+    (fewer if the database limits the number of parameters per query).
+    The voc manager is only called for the other patterns,
+    in parallel for remote vocabularies.
+    The new terms are inserted in bulk.
+
+    Throws an exception if no vocabulary with that prefix is found.
+    """
+    from django.db import connection
+    from django.db.models import Q
+    from django.db.models.functions import Lower
+    from .vocabularies.base_http import VocabularyHTTP
+
+    vocabulary = ControlledVocabulary.objects.get(prefix=prefix)
+    batch_size = get_var("BULK_BATCH_SIZE")
+    # each key is used twice in the query, plus the vocabulary id
+    # (e.g. SQLite < 3.32 accepts at most 999 parameters per query)
+    max_params = connection.features.max_query_params
+    if max_params:
+        batch_size = min(batch_size, (max_params - 1) // 2)
+
+    # pattern: ControlledTerm
+    found = {}
+
+    # try the DB first
+    unique = list({pattern for pattern in patterns if pattern})
+    for i in range(0, len(unique), batch_size):
+        # compared with LOWER(pattern), like search_term()
+        batch = _get_lower_in_db(unique[i:i + batch_size])
+        keys = set(batch.values())
+        records = (
+            ControlledTerm.objects.filter(vocabulary=vocabulary)
+            .select_related(None)
+            .annotate(termid_lower=Lower("termid"), label_lower=Lower("label"))
+            .filter(Q(termid_lower__in=keys) | Q(label_lower__in=keys))
+            .order_by("termid")
+        )
+        # lowercase key: ControlledTerm
+        records_by_key = {}
+        for record in records:
+            for key in (record.termid_lower, record.label_lower):
+                records_by_key.setdefault(key, record)
+        for pattern, key in batch.items():
+            if key in records_by_key:
+                found[pattern] = records_by_key[key]
+
+    # search the other patterns using the voc manager
+    # lowercase pattern: ControlledTerm
+    searched = {}
+    missing = list({pattern.lower() for pattern in unique if pattern not in found})
+    manager = ControlledVocabularyConfig.get_vocabulary_manager(vocabulary.prefix)
+    if missing and manager:
+        if isinstance(manager, VocabularyHTTP):
+            results = _get_bulk_executor().map(manager.search, missing)
+        else:
+            results = map(manager.search, missing)
+
+        terms = {}
+        for key, result in zip(missing, results):
+            term = _select_term(result, key, exact)
+            if term:
+                terms[key] = [
+                    vocabulary.id,
+                    term[0].strip(),
+                    term[1],
+                    term[2] if len(term) > 2 else "",
+                ]
+
+        records = ControlledTerm.get_or_create_many(list(terms.values()))
+        searched.update(zip(terms.keys(), records))
+
+    return [
+        found.get(pattern, None) or searched.get(pattern.lower(), None)
+        if pattern
+        else None
+        for pattern in patterns
+    ]
+
+
+def _get_lower_in_db(values):
+    """Returns {value: LOWER(value)} as computed by the database
+    (e.g. SQLite only lowers the ASCII characters).
+    The database is only queried for the non-ASCII values.
+    """
+    ret = {}
+
+    others = []
+    for value in values:
+        try:
+            value.encode("ascii")
+            ret[value] = value.lower()
+        except UnicodeEncodeError:
+            others.append(value)
+
+    if others:
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT {}".format(", ".join(["LOWER(%s)"] * len(others))), others
             )
+            ret.update(zip(others, cursor.fetchone()))
+
+    return ret
+
+
+def _select_term(terms, pattern, exact):
+    """Returns the first term in <terms> which label or termid
+    matches <pattern> (lowercase), or None. See search_term()."""
+    ret = None
+
+    for t in terms or []:
+        if exact:
+            if t[1].lower() == pattern or t[0].lower() == pattern:
+                ret = t
+                break
+        else:
+            if pattern in t[1].lower() or pattern in t[0].lower():
+                ret = t
+                break
 
     return ret
 
@@ -91,3 +241,197 @@ def search_term_or_none(
     return ret
 
 
+def search_federated(
+    vocabularies, pattern: str, limit: Optional[int] = None, deadline=None
+) -> List[Tuple["ControlledVocabulary", list]]:
+    """Searches <pattern> in all the vocabularies matching <vocabularies>
+    at the same time.
+
+    'vocabularies' has the same format as in ControlledTermField,
+    e.g. ['iso639-2', 'concept.wikidata:Q34770'] or 'concept.wikidata:Q34770'
+
+    Each vocabulary manager is called in a separate thread.
+    The search only waits <deadline> seconds
+    (default: settings.CONTROLLED_VOCABULARY_FEDERATED_SEARCH_DEADLINE).
+    Vocabularies which haven't returned by then, or failed, are ignored.
+    Vocabularies without manager are searched in the database,
+    see db_search.py.
+
+    Returns a list of (ControlledVocabulary, [termid, label, description]).
+    The terms are merged by rank: the first term of each vocabulary,
+    then the second ones, etc.
+    Vocabularies are in the order of <vocabularies>, then by prefix.
+    Each vocabulary returns at most <limit> terms.
+    """
+    if isinstance(vocabularies, str):
+        vocabularies = [vocabularies]
+    if deadline is None:
+        deadline = get_var("FEDERATED_SEARCH_DEADLINE")
+    start = time.monotonic()
+
+    records = sorted(
+        filter_vocabularies(vocabularies),
+        key=lambda record: [
+            vocabularies.index(record.prefix)
+            if record.prefix in vocabularies
+            else len(vocabularies),
+            record.prefix,
+        ],
+    )
+
+    results = {}
+    futures = {}
+    executor = _get_federated_executor()
+    for record in records:
+        manager = ControlledVocabularyConfig.get_vocabulary_manager(record.prefix)
+        if manager:
+            futures[
+                executor.submit(search_window, manager, pattern, limit=limit)
+            ] = record
+
+    for record in records:
+        if record not in futures.values():
+            from .db_search import get_db_search_backend
+
+            terms = get_db_search_backend().search(record, pattern)[:limit]
+            results[record] = [
+                [term.termid, term.label, term.description or ""]
+                for term in terms
+            ]
+
+    done, not_done = wait(
+        futures, timeout=max(0, deadline - (time.monotonic() - start))
+    )
+    for future in done:
+        if future.exception() is None:
+            results[futures[future]] = future.result()
+
+    ret = []
+    ranked = [
+        [rank, i, record, term]
+        for i, record in enumerate(records)
+        for rank, term in enumerate(results.get(record, []))
+    ]
+    for rank, i, record, term in sorted(ranked, key=lambda r: r[:2]):
+        desc = term[2] if len(term) > 2 else ""
+        ret.append((record, [term[0], term[1], desc]))
+
+    return ret
+
+
+def materialize_vocabulary(prefix: str, batch_size: Optional[int] = None) -> dict:
+    """Copies all the terms of the vocabulary with the given <prefix>
+    from its manager into the database (ControlledTerm).
+
+    The manager must be able to list all its terms
+    (i.e. implement _get_searchable_terms(), see VocabularyBaseList).
+
+    Terms are written <batch_size> at a time
+    (default: settings.CONTROLLED_VOCABULARY_BULK_BATCH_SIZE),
+    each batch in its own transaction: new terms are inserted,
+    existing terms which label or description has changed are updated.
+
+    Returns statistics, e.g.
+    {"terms": 3, "created": 1, "updated": 1, "duration": 0.01}
+
+    Throws an exception if no vocabulary with that prefix is found.
+    """
+    from itertools import islice
+
+    vocabulary = ControlledVocabulary.objects.get(prefix=prefix)
+    manager = ControlledVocabularyConfig.get_vocabulary_manager(prefix)
+    if batch_size is None:
+        batch_size = get_var("BULK_BATCH_SIZE")
+
+    ret = {"terms": 0, "created": 0, "updated": 0, "duration": 0}
+    start = time.perf_counter()
+
+    terms = iter(manager._get_searchable_terms())
+    while True:
+        batch = list(islice(terms, batch_size))
+        if not batch:
+            break
+        ret["terms"] += len(batch)
+        created, updated = _write_terms(vocabulary, batch)
+        ret["created"] += created
+        ret["updated"] += updated
+
+    ret["duration"] = time.perf_counter() - start
+
+    return ret
+
+
+def _write_terms(vocabulary, terms):
+    """Inserts or updates <terms> ([termid, label, description])
+    in <vocabulary>, in one transaction.
+    Returns the number of created and updated ControlledTerm records.
+    """
+    from django.db import transaction
+
+    # termid: (label, description), the first term wins
+    values = {}
+    for term in terms:
+        termid = term[0].strip()
+        if termid not in values:
+            desc = (term[2] if len(term) > 2 else "") or ""
+            values[termid] = (term[1][:LENGTH_LABEL], desc)
+
+    with transaction.atomic():
+        records = (
+            ControlledTerm.objects.filter(vocabulary=vocabulary, termid__in=list(values))
+            .select_related(None)
+            .only("id", "termid", "label", "description")
+        )
+        existing = {term.termid: term for term in records}
+
+        created = [
+            ControlledTerm(
+                vocabulary=vocabulary, termid=termid, label=label, description=desc
+            )
+            for termid, (label, desc) in values.items()
+            if termid not in existing
+        ]
+        # a concurrent process may have inserted some of these terms
+        ControlledTerm.objects.bulk_create(created, ignore_conflicts=True)
+
+        updated = []
+        for termid, term in existing.items():
+            label, desc = values[termid]
+            if (term.label, term.description or "") != (label, desc):
+                term.label, term.description = label, desc
+                updated.append(term)
+        ControlledTerm.objects.bulk_update(updated, ["label", "description"])
+
+    return len(created), len(updated)
+
+
+def _get_federated_executor():
+    """Returns the pool of threads used by search_federated()."""
+    global _federated_executor
+
+    if _federated_executor is None:
+        with _federated_executor_lock:
+            if _federated_executor is None:
+                _federated_executor = ThreadPoolExecutor(
+                    max_workers=get_var("FEDERATED_SEARCH_WORKERS"),
+                    thread_name_prefix="controlled_vocabulary",
+                )
+
+    return _federated_executor
+
+
+def _get_bulk_executor():
+    """Returns the pool of threads used by search_term_many().
+    Separate from the one of search_federated() so a large import
+    doesn't delay the searches of the autocomplete."""
+    global _bulk_executor
+
+    if _bulk_executor is None:
+        with _bulk_executor_lock:
+            if _bulk_executor is None:
+                _bulk_executor = ThreadPoolExecutor(
+                    max_workers=get_var("BULK_SEARCH_WORKERS"),
+                    thread_name_prefix="controlled_vocabulary_bulk",
+                )
+
+    return _bulk_executor
@@ -1,4 +1,5 @@
 import urllib.parse
+from collections.abc import Sequence
 
 from django.http import JsonResponse
 from django.http.response import Http404
@@ -6,6 +7,7 @@ from django.shortcuts import render
 from django.views.generic.list import ListView
 
 from .models import ControlledTerm, ControlledVocabulary
+from .vocabularies.base import VocabularyBase, get_window, search_window
 
 
 class TermListView(ListView):
@@ -22,6 +24,42 @@ class TermListView(ListView):
         """returns the value of the q parameter in the query string"""
         return self.request.GET.get("term", "")
 
+    def _get_cursor_from_request(self):
+        """Returns the value of the cursor parameter in the query string,
+        None if the page is not requested by cursor (see pagination.py)."""
+        return self.request.GET.get("cursor", None)
+
+    def _get_cursor_scope(self):
+        """Returns what identifies the searched terms in the cursors."""
+        return [
+            self.request.GET.get("prefix") or self.kwargs.get("prefix") or "",
+            self.request.GET.get("vocabularies", ""),
+            self._get_query_from_request(),
+        ]
+
+    def _get_page_end(self):
+        """Returns the number of search results needed to render
+        the requested page, plus one to know if there is a next page.
+        None if the page number is not known in advance (e.g. 'last').
+        """
+        cursor = self._get_cursor_from_request()
+        if cursor is not None:
+            from .pagination import decode_cursor
+
+            position = decode_cursor(cursor, self._get_cursor_scope()) or {}
+            return position.get("offset", 0) + self.get_paginate_by(None) + 1
+
+        page = (
+            self.kwargs.get(self.page_kwarg)
+            or self.request.GET.get(self.page_kwarg)
+            or 1
+        )
+        try:
+            ret = int(page) * self.get_paginate_by(None) + 1
+        except ValueError:
+            ret = None
+        return ret
+
     def get_queryset(self):
         voc_record = self._get_vocabulary_record_from_request()
         if not voc_record:
@@ -37,16 +75,23 @@ class TermListView(ListView):
         # if no voc, we do a DB query
         user_query = self._get_query_from_request()
         if not (voc_manager):
-            return self.model.objects.filter(
-                vocabulary=voc_record, label__icontains=user_query
-            )
+            from .db_search import get_db_search_backend
+
+            return get_db_search_backend().search(voc_record, user_query)
+
+        # search with manager,
+        # only the terms of the requested page are converted to ControlledTerm
+        return SearchResults(
+            voc_manager,
+            user_query,
+            lambda terms: self._get_terms_from_search_results(terms, voc_record),
+        )
 
-        # search with manager
-        # TODO: use a generator,
-        # wasteful to convert all entries to ControlledTerm()
-        # if only few displayed
+    def _get_terms_from_search_results(self, terms, voc_record):
+        """Returns a list of (unsaved) ControlledTerm
+        from a list of terms returned by a vocabulary manager."""
         ret = []
-        for term in voc_manager.search(user_query):
+        for term in terms:
             description = ""
             if len(term) > 2:
                 description = term[2]
@@ -60,25 +105,176 @@ class TermListView(ListView):
 
         return ret
 
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self._get_cursor_from_request()
+        if cursor is None:
+            return super().paginate_queryset(queryset, page_size)
+
+        from .pagination import CursorPage
+
+        page = CursorPage(queryset, cursor, page_size, self._get_cursor_scope())
+        return (None, page, page.object_list, page.has_next())
+
     def render_to_response(self, context, **response_kwargs):
-        page_obj = context["page_obj"]
+        return self._get_json_response(context["page_obj"])
+
+    def _get_json_response(self, page_obj):
         # this format conforms with select2 / django autocomplete API
+        # more is the cursor of the next page if requested by cursor
+        more = page_obj.has_next()
+        if more and getattr(page_obj, "next_cursor", None):
+            more = page_obj.next_cursor
+
         res = {
-            "results": [
-                {
-                    "id": term.pk
-                    or "{}::{}::{}::{}".format(
-                        term.vocabulary_id,
-                        term.termid,
-                        term.label,
-                        urllib.parse.quote_plus(term.description),
-                    ),
-                    "termid": term.termid,
-                    "text": term.label,
-                    "description": term.description,
-                }
-                for term in page_obj
-            ],
-            "pagination": {"more": page_obj.has_next()},
+            "results": [self._get_json_result(term) for term in page_obj],
+            "pagination": {"more": more},
         }
         return JsonResponse(res)
+
+    def _get_json_result(self, term):
+        return {
+            "id": term.pk
+            or "{}::{}::{}::{}".format(
+                term.vocabulary_id,
+                term.termid,
+                term.label,
+                urllib.parse.quote_plus(term.description),
+            ),
+            "termid": term.termid,
+            "text": term.label,
+            "description": term.description,
+        }
+
+
+class SearchResults(Sequence):
+    """Lazy sequence of the terms found by a vocabulary manager
+    for <pattern>, to be paginated.
+
+    len() asks the manager for the number of terms (see VocabularyBase.count)
+    and a slice only searches the terms within it, which are then
+    converted with <convert> (e.g. into ControlledTerm).
+    If the manager can't count its terms without searching them
+    (it doesn't override count(), e.g. VocabularyHTTP), they are
+    searched once and kept for len() and the slices.
+    """
+
+    def __init__(self, manager, pattern, convert):
+        self.manager = manager
+        self.pattern = pattern
+        self.convert = convert
+        self._count = None
+        # all the terms, see _get_all_terms()
+        self._terms = None
+
+    def __len__(self):
+        if self._count is None:
+            if self._can_count():
+                self._count = self.manager.count(self.pattern)
+            else:
+                self._count = len(self._get_all_terms())
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if (index.start or 0) >= 0 and (index.stop or -1) >= 0:
+                # no need to count the terms, e.g. [10:21]
+                start, stop, step = index.start or 0, index.stop, index.step
+            else:
+                start, stop, step = index.indices(len(self))
+            limit = max(stop - start, 0)
+            if self._can_count():
+                terms = search_window(
+                    self.manager, self.pattern, limit=limit, offset=start
+                )
+            else:
+                terms = get_window(self._get_all_terms(), limit, start)
+            return self.convert(terms)[::step]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("search result index out of range")
+        return self[index:index + 1][0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def _can_count(self):
+        """Returns True if the manager counts its terms
+        without searching them (i.e. it overrides count())."""
+        return (
+            getattr(type(self.manager), "count", VocabularyBase.count)
+            is not VocabularyBase.count
+        )
+
+    def _get_all_terms(self):
+        if self._terms is None:
+            self._terms = search_window(self.manager, self.pattern)
+        return self._terms
+
+
+class FederatedTermListView(TermListView):
+    """Autocomplete across all the vocabularies matching the
+    'vocabularies' parameter (comma separated, see ControlledTermField).
+    The vocabularies are searched at the same time, see search_federated().
+    e.g. ?vocabularies=iso639-2,concept.wikidata:Q34770&term=eng
+    """
+
+    def get_queryset(self):
+        from .utils import search_federated
+
+        vocabularies = self.request.GET.get("vocabularies", "").split(",")
+
+        ret = []
+        for voc_record, term in search_federated(
+            vocabularies,
+            self._get_query_from_request(),
+            limit=self._get_page_end(),
+        ):
+            ret.extend(self._get_terms_from_search_results([term], voc_record))
+
+        return ret
+
+    def _get_json_result(self, term):
+        ret = super()._get_json_result(term)
+        ret["prefix"] = term.vocabulary.prefix
+        return ret
+
+
+async def term_list_async(request, prefix=None):
+    """Async version of TermListView, for ASGI deployments (Django 3.1+).
+
+    The search in a remote vocabulary doesn't block a thread
+    while waiting for the response, see VocabularyHTTP.asearch().
+    """
+    from asgiref.sync import sync_to_async
+
+    from .apps import ControlledVocabularyConfig
+
+    kwargs = {}
+    if prefix:
+        kwargs["prefix"] = prefix
+
+    view = TermListView()
+    view.setup(request, **kwargs)
+
+    voc_record = await sync_to_async(view._get_vocabulary_record_from_request)()
+    if not voc_record:
+        raise Http404()
+
+    voc_manager = ControlledVocabularyConfig.get_vocabulary_manager(
+        voc_record.prefix
+    )
+    if not voc_manager:
+        # DB query, same as the synchronous view
+        return await sync_to_async(TermListView.as_view())(request, **kwargs)
+
+    terms = await voc_manager.asearch(
+        view._get_query_from_request(), limit=view._get_page_end()
+    )
+    object_list = view._get_terms_from_search_results(terms, voc_record)
+    paginator, page_obj, object_list, is_paginated = view.paginate_queryset(
+        object_list, view.get_paginate_by(object_list)
+    )
+
+    return view._get_json_response(page_obj)
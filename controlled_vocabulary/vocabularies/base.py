@@ -1,3 +1,14 @@
+import asyncio
+import os
+import threading
+import weakref
+
+from ..settings import get_var
+
+USER_AGENT = "django-controlled-vocabulary/0.1"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
 class VocabularyBase:
     """Abstract vocabulary management / plugin class.
     Subclasses MUST override the following fields.
@@ -15,23 +26,284 @@ class VocabularyBase:
     # e.g. 'wikidata:Q34770:language'
     concept = ""
 
+    def count(self, pattern):
+        """Returns the number of terms search(<pattern>) returns.
+        Subclasses can override it to count without building the terms.
+        """
+        return len(self.search(pattern))
+
+    async def asearch(self, pattern, limit=None, offset=0):
+        """Coroutine version of search(), for async views.
+        By default it just calls search(), which is fine for managers
+        that don't do any I/O (e.g. VocabularyBaseList).
+        """
+        return search_window(self, pattern, limit=limit, offset=offset)
+
+
+def search_window(manager, pattern, limit=None, offset=0):
+    """Returns manager.search(<pattern>, limit=<limit>, offset=<offset>).
+
+    limit and offset are optional in the signature of search():
+    if the manager doesn't accept them (e.g. a third-party plugin written
+    for search(self, pattern)), the window is taken from all its results.
+    """
+    if _accepts_window(type(manager)):
+        return manager.search(pattern, limit=limit, offset=offset)
+    return get_window(manager.search(pattern), limit, offset)
+
+
+# manager class: True if its search() accepts limit and offset
+_window_support = {}
+
+
+def _accepts_window(manager_class):
+    ret = _window_support.get(manager_class, None)
+    if ret is None:
+        import inspect
+
+        try:
+            parameters = inspect.signature(manager_class.search).parameters
+        except (AttributeError, TypeError, ValueError):
+            parameters = {}
+        ret = _window_support[manager_class] = all(
+            name in parameters for name in ["limit", "offset"]
+        ) or any(
+            parameter.kind == parameter.VAR_KEYWORD
+            for parameter in parameters.values()
+        )
+
+    return ret
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Returns the urllib3 PoolManager shared by all the vocabularies.
+    It is thread-safe and keeps connections alive for each remote host.
+    See the CONTROLLED_VOCABULARY_HTTP_* settings.
+    """
+    global _http_client
+
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                import urllib3
+
+                _http_client = urllib3.PoolManager(
+                    num_pools=get_var("HTTP_POOLS"),
+                    maxsize=get_var("HTTP_POOL_SIZE"),
+                    headers={"user-agent": USER_AGENT},
+                    timeout=urllib3.Timeout(
+                        connect=get_var("HTTP_CONNECT_TIMEOUT"),
+                        read=get_var("HTTP_READ_TIMEOUT"),
+                    ),
+                    retries=urllib3.Retry(
+                        total=get_var("HTTP_RETRIES"),
+                        backoff_factor=get_var("HTTP_BACKOFF"),
+                        status_forcelist=[429, 500, 502, 503, 504],
+                        raise_on_status=False,
+                    ),
+                )
+
+    return _http_client
+
 
 def fetch(url):
     """Returns the content at the given url.
-    Returns None is status != 200."""
+    Returns None if status != 200 or the request failed
+    (e.g. timeout, connection error, after all the retries)."""
+    import urllib3
+    ret = None
+
+    try:
+        response = get_http_client().request("GET", url)
+    except urllib3.exceptions.HTTPError:
+        response = None
+
+    if response is not None and response.status == 200:
+        ret = response.data
+
+    return ret
+
+
+def fetch_to_file(url, path, etag=None, last_modified=None):
+    """Downloads the content at <url> into the file at <path>.
+
+    The content is streamed in chunks into <path>.part,
+    which replaces <path> once complete.
+    If a previous download was interrupted, it is resumed with a Range
+    request (unless the content has changed on the server since).
+    If <etag> or <last_modified> (returned by a previous download)
+    are given, the content is not downloaded again if it hasn't changed.
+
+    Returns a dictionary:
+        status: 'downloaded', 'not modified' or None if the request failed
+        size: number of bytes of the file
+        etag, last_modified: validators of the content, for the next call
+    """
+    import json
+
     import urllib3
+
+    ret = {"status": None, "size": 0, "etag": None, "last_modified": None}
+
+    part_path = path + ".part"
+    part_info_path = part_path + ".json"
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    # resume an interrupted download
+    part_info = {}
+    if os.path.exists(part_path) and os.path.exists(part_info_path):
+        with open(part_info_path) as fh:
+            part_info = json.load(fh)
+        validator = part_info.get("etag") or part_info.get("last_modified")
+        if validator:
+            headers["Range"] = "bytes={}-".format(os.path.getsize(part_path))
+            headers["If-Range"] = validator
+
+    try:
+        response = get_http_client().request(
+            "GET", url, headers=headers, preload_content=False
+        )
+    except urllib3.exceptions.HTTPError:
+        return ret
+
+    try:
+        if response.status == 304:
+            ret["status"] = "not modified"
+            ret["etag"], ret["last_modified"] = etag, last_modified
+            if os.path.exists(path):
+                ret["size"] = os.path.getsize(path)
+            return ret
+
+        if response.status == 416 and "Range" in headers:
+            # the partial download is not valid, start again
+            os.remove(part_path)
+            os.remove(part_info_path)
+            return fetch_to_file(url, path, etag, last_modified)
+
+        if response.status not in [200, 206]:
+            return ret
+
+        if response.status == 200:
+            part_info = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            with open(part_info_path, "w") as fh:
+                json.dump(part_info, fh)
+
+        with open(part_path, "ab" if response.status == 206 else "wb") as fh:
+            for chunk in response.stream(DOWNLOAD_CHUNK_SIZE):
+                fh.write(chunk)
+    except (urllib3.exceptions.HTTPError, OSError):
+        # the partial download will be resumed next time
+        return ret
+    finally:
+        response.release_conn()
+
+    os.replace(part_path, path)
+    os.remove(part_info_path)
+
+    ret["status"] = "downloaded"
+    ret["size"] = os.path.getsize(path)
+    ret["etag"] = part_info.get("etag")
+    ret["last_modified"] = part_info.get("last_modified")
+
+    return ret
+
+
+# event loop: (httpx.AsyncClient, closer), see get_async_http_client()
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client():
+    """Returns the httpx.AsyncClient shared by all the vocabularies
+    in the running event loop. Same settings as get_http_client().
+
+    The client is closed when the event loop shuts down
+    (see _close_on_loop_shutdown()).
+    """
+    import httpx
+
+    loop = asyncio.get_event_loop()
+    entry = _async_http_clients.get(loop, None)
+    if entry is None:
+        client = httpx.AsyncClient(
+            headers={"user-agent": USER_AGENT},
+            timeout=httpx.Timeout(
+                get_var("HTTP_READ_TIMEOUT"),
+                connect=get_var("HTTP_CONNECT_TIMEOUT"),
+            ),
+            limits=httpx.Limits(
+                max_keepalive_connections=get_var("HTTP_POOL_SIZE"),
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=get_var("HTTP_RETRIES")),
+            # like urllib3 in fetch()
+            follow_redirects=True,
+        )
+        closer = _close_on_loop_shutdown(client)
+        # runs the generator until its yield, it is then registered
+        # in the loop, which finalises it before closing
+        asyncio.ensure_future(closer.__anext__())
+        entry = _async_http_clients[loop] = (client, closer)
+
+    return entry[0]
+
+
+async def _close_on_loop_shutdown(client):
+    """Closes <client> when the event loop finalises this generator,
+    i.e. in loop.shutdown_asyncgens(), called by asyncio.run()
+    (and asgiref, uvicorn, ...) before closing the loop.
+    """
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def afetch(url):
+    """Coroutine version of fetch().
+    Uses httpx if it is installed (non-blocking client).
+    Otherwise, runs fetch() in a thread so the event loop is not blocked.
+    """
+    try:
+        import httpx
+    except ImportError:
+        httpx = None
+
+    if httpx is None:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, fetch, url)
+
     ret = None
 
-    # TODO: error management
-    headers = {"user-agent": "django-controlled-vocabulary/0.1"}
-    http = urllib3.PoolManager(headers=headers)
-    request = http.request("GET", url)
-    if request.status == 200:
-        ret = request.data
+    try:
+        response = await get_async_http_client().get(url)
+    except httpx.HTTPError:
+        response = None
+
+    if response is not None and response.status_code == 200:
+        ret = response.content
 
     return ret
 
 
+def get_window(terms, limit=None, offset=0):
+    """Returns <limit> terms (all if None) from <terms>,
+    skipping the first <offset>."""
+    if limit is None:
+        return terms[offset:]
+    return terms[offset:offset + limit]
+
+
 def chrono(msg):
     from datetime import datetime
 
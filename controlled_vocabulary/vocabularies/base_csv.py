@@ -1,7 +1,9 @@
 import fnmatch
+import hashlib
 
 from .base import VocabularyBase, chrono
 from .base_list import VocabularyBaseList
+from .term_index import TermIndex, build_term_index, write_term_index
 from ..settings import get_var
 import os
 import re
@@ -30,6 +32,9 @@ class VocabularyBaseCSV(VocabularyBaseList):
         # optional, the path of a file to extract from the downloaded url
         "extract": "file_to_extract",
     }
+    # increase this number each time _get_terms_from_csv_line() changes,
+    # so the index of the terms is rebuilt from the files already on disk
+    parser_version = 1
 
     def _get_terms_from_csv_line(self, line):
         '''Subclass should override this method.
@@ -46,6 +51,106 @@ class VocabularyBaseCSV(VocabularyBaseList):
         ret = get_var("DATA_ROOT")
         return ret
 
+    def _load_searchable_terms(self):
+        """Returns all the terms, sorted by label.
+        They are read from the binary index of the CSV (see build_index()),
+        which is memory-mapped so all processes share the same copy.
+        The index is (re)built if it is missing or stale, see get_fingerprint().
+        """
+        ret = getattr(self, "_searchable_terms", None)
+        if ret is None:
+            try:
+                ret = self._open_index()
+            except OSError:
+                # e.g. read-only data root, the index is kept in memory
+                terms = sorted(self._get_searchable_terms(), key=lambda t: t[1])
+                ret = TermIndex(build_term_index(terms))
+
+            self._searchable_terms = ret
+
+        return ret
+
+    def _open_index(self):
+        """Returns the index of the terms, (re)built if needed."""
+        if not self._download_if_missing() and self.is_index_stale():
+            self.build_index()
+
+        index_path = self._get_index_path()
+        try:
+            ret = TermIndex.open(index_path)
+        except ValueError:
+            # index written by another version of this app
+            self.build_index()
+            ret = TermIndex.open(index_path)
+
+        return ret
+
+    def build_index(self):
+        """Writes the binary index of the terms next to the CSV file.
+        Returns the size of the index.
+        """
+        fingerprint = self.get_fingerprint()
+        terms = sorted(self._get_searchable_terms(), key=lambda t: t[1])
+        ret = write_term_index(terms, self._get_index_path())
+        self._write_metadata(index=fingerprint)
+
+        return ret
+
+    def get_fingerprint(self):
+        """Returns what the terms of this vocabulary are derived from:
+        {"sha256": hash of the CSV file, "parser_version": self.parser_version}
+        The hash is stored in the metadata and only recomputed
+        when the size or modification time of the file changes.
+        """
+        filepath = self._get_filepath()
+        stat = os.stat(filepath)
+
+        content = self._read_metadata().get("content", {})
+        if [content.get("size"), content.get("mtime")] != [
+            stat.st_size,
+            stat.st_mtime,
+        ]:
+            content = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": _get_file_sha256(filepath),
+            }
+            try:
+                self._write_metadata(content=content)
+            except OSError:
+                # read-only data root, the hash will be computed again
+                pass
+
+        return {"sha256": content["sha256"], "parser_version": self.parser_version}
+
+    def is_index_stale(self):
+        """Returns True if the index of the terms is missing
+        or if the CSV file or the parser have changed since it was built.
+        """
+        return (
+            not os.path.exists(self._get_index_path())
+            or self._read_metadata().get("index") != self.get_fingerprint()
+        )
+
+    def _get_index_path(self):
+        return self._get_filepath() + ".idx"
+
+    def _download_if_missing(self):
+        """Download the CSV if it doesn't exist yet.
+        Returns True if it has been downloaded.
+        """
+        ret = False
+
+        filepath = self._get_filepath()
+
+        if not os.path.exists(filepath):
+            download_info = self.download()
+            if download_info[2] < 1:
+                raise Exception("download {} failed".format(filepath))
+            ret = True
+
+        return ret
+
     def _get_searchable_terms(self):
         """Returns all terms from the CSV.
         Download the CSV if it doesn't exist yet.
@@ -55,10 +160,7 @@ class VocabularyBaseCSV(VocabularyBaseList):
 
         filepath = self._get_filepath()
 
-        if not os.path.exists(filepath):
-            download_info = self.download()
-            if download_info[2] < 1:
-                raise Exception("download {} failed".format(filepath))
+        self._download_if_missing()
 
         options = {}
         if "delimiter" in self.source:
@@ -76,8 +178,12 @@ class VocabularyBaseCSV(VocabularyBaseList):
         return ret
 
     def download(self, overwrite=False):
-        """Download self.source"""
-        from .base import fetch
+        """Download self.source
+        The file is streamed to disk, see fetch_to_file().
+        If overwrite is True, the file is only downloaded again
+        if it has changed on the server (ETag / Last-Modified).
+        """
+        from .base import fetch_to_file
 
         url = self.source["url"]
         filepath = self._get_filepath()
@@ -86,22 +192,69 @@ class VocabularyBaseCSV(VocabularyBaseList):
 
         if re.search("^https?://", url):
             if overwrite or not os.path.exists(filepath):
-                content = fetch(url)
+                metadata = {}
+                if os.path.exists(filepath):
+                    metadata = self._read_metadata()
+
+                input_path = self._get_filepath(True)
+                res = fetch_to_file(
+                    url,
+                    input_path,
+                    etag=metadata.get("etag"),
+                    last_modified=metadata.get("last_modified"),
+                )
 
-                if content is not None:
-                    size = len(content)
+                if res["status"] == "downloaded":
+                    size = res["size"]
                     downloaded = 1
 
-                    input_path = self._get_filepath(True)
-                    with open(input_path, "wb") as fh:
-                        fh.write(content)
-
                     filepath = self._process_file(input_path)
+                    self._write_metadata(
+                        etag=res["etag"], last_modified=res["last_modified"]
+                    )
+                elif res["status"] == "not modified":
+                    size = os.path.getsize(filepath)
             else:
                 size = os.path.getsize(filepath)
 
+            # the file may have been downloaded again without any change
+            if size and self.is_index_stale():
+                self.build_index()
+
         return [url, filepath, size, downloaded]
 
+    def _read_metadata(self):
+        """Returns the metadata stored alongside the (processed) file.
+        e.g. {"etag": "...", "last_modified": "...", "content": {...},
+        "index": {...}}, see get_fingerprint()
+        """
+        import json
+
+        ret = {}
+        path = self._get_metadata_path()
+        if os.path.exists(path):
+            with open(path) as fh:
+                ret = json.load(fh)
+
+        return ret
+
+    def _write_metadata(self, **values):
+        """Updates the metadata stored alongside the (processed) file."""
+        import json
+
+        metadata = self._read_metadata()
+        metadata.update(values)
+
+        path = self._get_metadata_path()
+        # other processes may be writing it at the same time
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w") as fh:
+            json.dump(metadata, fh, indent=2)
+        os.replace(temp_path, path)
+
+    def _get_metadata_path(self):
+        return self._get_filepath() + ".json"
+
     def _process_file(self, input_path):
         '''optionally transform the downloaded file
         or extract something from it.'''
@@ -171,3 +324,10 @@ class VocabularyBaseCSV(VocabularyBaseList):
     def _get_absolute_path(self, relative_path):
         return os.path.join(self._get_data_root(), relative_path)
 
+
+def _get_file_sha256(path):
+    ret = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            ret.update(chunk)
+    return ret.hexdigest()
@@ -1,5 +1,15 @@
-from .base import VocabularyBase, fetch
+from .base import VocabularyBase, afetch, fetch, get_window
+from .breaker import CircuitBreaker
+from .cache import get_search_cache, normalise_pattern
+from .singleflight import search_flights
+from ..settings import get_var
 import json
+import threading
+import time
+
+
+class VocabularySearchError(Exception):
+    """The remote service failed or returned an invalid response."""
 
 
 class VocabularyHTTP(VocabularyBase):
@@ -13,8 +23,16 @@ class VocabularyHTTP(VocabularyBase):
     source = {
         "url": "https://some-domain.org/search/?&query={pattern}",
         "minimum_length": 1,
+        # optional, number of seconds search results are cached
+        # if unspecified, settings.CONTROLLED_VOCABULARY_SEARCH_CACHE_TTL
+        "cache_ttl": 60 * 60,
+        # optional, number of seconds empty results and errors are cached
+        # if unspecified, settings.CONTROLLED_VOCABULARY_SEARCH_CACHE_NEGATIVE_TTL
+        "negative_cache_ttl": 30,
     }
 
+    _breaker_lock = threading.Lock()
+
     def parse_search_response(self, res):
         """TO BE OVERRIDEN
         res: the http response as a python dictionary
@@ -25,15 +43,144 @@ class VocabularyHTTP(VocabularyBase):
 
         return ret
 
-    def search(self, pattern):
+    def search(self, pattern, limit=None, offset=0):
+        """Returns the terms found by the remote service for <pattern>.
+        Only returns <limit> terms (all if None), skipping the first <offset>.
+        Results are cached, see cache.py.
+        Concurrent searches for the same pattern share a single remote
+        request, see singleflight.py.
+        Returns no terms if the remote service fails or if its circuit
+        breaker is open, see breaker.py.
+        """
+        ret = []
+        if len(pattern) < self.source.get("minimum_length", 1):
+            return ret
+
+        ret = get_search_cache().get(self.prefix, pattern)
+        if ret is None:
+            ret = search_flights.call(
+                (self.prefix, normalise_pattern(pattern)),
+                self._search_remote_and_cache,
+                pattern,
+            )
+
+        ret = get_window(ret, limit, offset)
+
+        return ret
+
+    def _search_remote_and_cache(self, pattern):
+        if not self.get_circuit_breaker().allow():
+            return []
+
+        start = time.monotonic()
+        try:
+            ret = self._search_remote(pattern)
+        except Exception:
+            # VocabularySearchError or an unexpected response
+            # (e.g. KeyError in parse_search_response), always recorded
+            # as a failure, otherwise a half-open breaker would stay probing
+            ret = None
+
+        return self._record_remote_search(pattern, ret, start)
+
+    async def _asearch_remote_and_cache(self, pattern):
+        if not self.get_circuit_breaker().allow():
+            return []
+
+        start = time.monotonic()
+        try:
+            ret = await self._asearch_remote(pattern)
+        except Exception:
+            # VocabularySearchError or an unexpected response
+            # (e.g. KeyError in parse_search_response), always recorded
+            # as a failure, otherwise a half-open breaker would stay probing
+            ret = None
+
+        return self._record_remote_search(pattern, ret, start)
+
+    def _record_remote_search(self, pattern, terms, start):
+        """Records the outcome of a remote search in the circuit breaker
+        and caches the terms. <terms> is None if the search failed.
+        Returns the terms (empty list if the search failed).
+        """
+        self.get_circuit_breaker().record(
+            terms is not None, time.monotonic() - start
+        )
+
+        if terms:
+            ttl = self.get_cache_ttl()
+        else:
+            ttl = self.get_negative_cache_ttl()
+            terms = []
+        get_search_cache().set(self.prefix, pattern, terms, ttl)
+
+        return terms
+
+    def get_cache_ttl(self):
+        """Returns the number of seconds search results are cached."""
+        ret = self.source.get("cache_ttl", None)
+        if ret is None:
+            ret = get_var("SEARCH_CACHE_TTL")
+        return ret
+
+    def get_negative_cache_ttl(self):
+        """Returns the number of seconds empty results
+        and failed searches are cached."""
+        ret = self.source.get("negative_cache_ttl", None)
+        if ret is None:
+            ret = get_var("SEARCH_CACHE_NEGATIVE_TTL")
+        return ret
+
+    def get_circuit_breaker(self):
+        """Returns the circuit breaker of the remote service
+        (one per manager)."""
+        ret = getattr(self, "_circuit_breaker", None)
+        if ret is None:
+            with self._breaker_lock:
+                ret = getattr(self, "_circuit_breaker", None)
+                if ret is None:
+                    ret = self._circuit_breaker = CircuitBreaker()
+        return ret
+
+    async def asearch(self, pattern, limit=None, offset=0):
+        """Same as search() but doesn't block the thread
+        while waiting for the remote service.
+        Concurrent calls are not coalesced."""
         ret = []
         if len(pattern) < self.source.get("minimum_length", 1):
             return ret
-        url = self.source["url"].format(pattern=pattern)
 
-        content = fetch(url)
-        content = content.decode("utf8")
-        res = json.loads(content)
+        ret = get_search_cache().get(self.prefix, pattern)
+        if ret is None:
+            ret = await self._asearch_remote_and_cache(pattern)
+
+        ret = get_window(ret, limit, offset)
+
+        return ret
+
+    def _search_remote(self, pattern):
+        """Returns all the terms found by the remote service for <pattern>."""
+        content = fetch(self._get_search_url(pattern))
+        return self._parse_content(content)
+
+    async def _asearch_remote(self, pattern):
+        """Coroutine version of _search_remote()."""
+        content = await afetch(self._get_search_url(pattern))
+        return self._parse_content(content)
+
+    def _get_search_url(self, pattern):
+        return self.source["url"].format(pattern=pattern)
+
+    def _parse_content(self, content):
+        if content is None:
+            raise VocabularySearchError("request to {} failed".format(self.prefix))
+
+        try:
+            res = json.loads(content.decode("utf8"))
+        except ValueError:
+            raise VocabularySearchError(
+                "invalid response from {}".format(self.prefix)
+            )
 
         ret = self.parse_search_response(res)
 
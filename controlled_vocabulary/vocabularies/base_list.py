@@ -1,4 +1,7 @@
-from .base import VocabularyBase
+import heapq
+
+from .base import VocabularyBase, get_window
+from .term_index import TermIndex, build_term_index
 
 
 class VocabularyBaseList(VocabularyBase):
@@ -20,7 +23,26 @@ class VocabularyBaseList(VocabularyBase):
         )
         return ret
 
-    def search(self, pattern):
+    def _load_searchable_terms(self):
+        """Returns all the terms, sorted by label, in a compact TermIndex.
+        Terms are lazy-loaded from _get_searchable_terms() and indexed
+        the first time they are needed, then cached in the object.
+        """
+        ret = getattr(self, "_searchable_terms", None)
+        if ret is None:
+            # sort alphabetically
+            terms = sorted(self._get_searchable_terms(), key=lambda t: t[1])
+
+            ret = self._searchable_terms = TermIndex(build_term_index(terms))
+
+        return ret
+
+    def _get_candidate_positions(self, pattern):
+        """Returns the sorted positions of the terms which may match
+        <pattern> (lowercase)."""
+        return self._searchable_terms.get_candidate_positions(pattern)
+
+    def search(self, pattern, limit=None, offset=0):
         """Returns terms that match the given patterns
         among those found in the full list supplied by _get_searchable_terms.
 
@@ -35,41 +57,64 @@ class VocabularyBaseList(VocabularyBase):
             exact match on the label [1]
             beginning of label matches the pattern (then alphabetical) [1]
             any part of the label matches the pattern (then alphabetical) [1]
-        """
-        # get all terms from the subclass and cache them in the object
-        self._searchable_terms = getattr(self, "_searchable_terms", None)
-        if self._searchable_terms is None:
-            # leave this here, so we only lazy-load terms
-            # the first time they are needed.
-            self._searchable_terms = self._get_searchable_terms()
 
-            # sort alphabetically
-            self._searchable_terms = sorted(self._searchable_terms, key=lambda t: t[1])
-
-        ret = []
+        Only returns <limit> terms (all if None), skipping the first <offset>.
+        """
+        terms = self._load_searchable_terms()
 
         # return only terms that match the input pattern
         pattern = pattern.lower()
 
         if pattern:
-            for term in self._searchable_terms:
-                score = 0
-                label = term[1].lower()
-                tid = term[0].lower()
-                if pattern in label: score += 1
-                if term[0].lower() == pattern: score += 4
-                if score:
-                    if label.startswith(pattern): score += 1
-                    if label == pattern: score += 1
-                    desc = ''
-                    if len(term) > 2:
-                        desc = term[2]
-                    ret.append([term[0], term[1], desc, score])
-
             # sort by score, then label then description
-            ret = sorted(ret, key=lambda t: [-t[3], t[1], t[2]])
+            # (and position, so ties keep the order of the list)
+            matches = self._get_scored_matches(pattern)
+            if limit is None:
+                matches = sorted(matches)[offset:]
+            else:
+                # partial selection, O(n log k) rather than a full sort
+                matches = heapq.nsmallest(offset + limit, matches)[offset:]
+
+            ret = [
+                [terms[i][0], label, desc, -neg_score]
+                for neg_score, label, desc, i in matches
+            ]
         else:
             # returns everything
-            ret = self._searchable_terms
+            ret = get_window(terms, limit, offset)
+
+        return ret
+
+    def count(self, pattern):
+        """Returns the number of terms search(<pattern>) returns,
+        without sorting them."""
+        terms = self._load_searchable_terms()
+
+        pattern = pattern.lower()
+        if pattern:
+            ret = sum(1 for match in self._get_scored_matches(pattern))
+        else:
+            ret = len(terms)
 
         return ret
+
+    def _get_scored_matches(self, pattern):
+        """Yields (-score, label, description, position)
+        for each term matching <pattern> (lowercase).
+        See search() for the scoring rules.
+        """
+        terms = self._searchable_terms
+
+        for i in self._get_candidate_positions(pattern):
+            term = terms[i]
+            score = 0
+            label = term[1].lower()
+            if pattern in label: score += 1
+            if term[0].lower() == pattern: score += 4
+            if score:
+                if label.startswith(pattern): score += 1
+                if label == pattern: score += 1
+                desc = ''
+                if len(term) > 2:
+                    desc = term[2]
+                yield (-score, term[1], desc, i)
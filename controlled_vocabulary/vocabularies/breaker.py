@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import deque
+
+from ..settings import get_var
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Stops calling a failing remote service for a while.
+
+    closed: calls are allowed. The outcome of the last <window> calls is
+        recorded; a call fails if it raises an error or is slower than
+        <slow_call> seconds. The circuit opens if at least <min_calls> were
+        recorded and the proportion of failures reaches <failure_rate>.
+    open: calls are refused (fail fast) for <reset_timeout> seconds.
+    half-open: a single call is allowed (probe). The circuit closes
+        if it succeeds, otherwise it opens again.
+
+    Settings: CONTROLLED_VOCABULARY_BREAKER_*
+    """
+
+    def __init__(
+        self,
+        failure_rate=None,
+        min_calls=None,
+        window=None,
+        slow_call=None,
+        reset_timeout=None,
+    ):
+        def default(value, name):
+            return get_var("BREAKER_" + name) if value is None else value
+
+        self.failure_rate = default(failure_rate, "FAILURE_RATE")
+        self.min_calls = default(min_calls, "MIN_CALLS")
+        self.slow_call = default(slow_call, "SLOW_CALL")
+        self.reset_timeout = default(reset_timeout, "RESET_TIMEOUT")
+
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=default(window, "WINDOW"))
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a call to the service is allowed now."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+
+            return True
+
+    def record(self, success, duration):
+        """Records the outcome of an allowed call.
+        success: False if the call failed
+        duration: number of seconds the call took
+        """
+        failed = not success or duration > self.slow_call
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                self._probing = False
+            elif self.state == CLOSED:
+                self._outcomes.append(failed)
+                if (
+                    len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes)
+                    >= self.failure_rate
+                ):
+                    self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
@@ -0,0 +1,147 @@
+"""
+Caches of the terms returned by the remote vocabularies (see VocabularyHTTP).
+
+The cache is selected with settings.CONTROLLED_VOCABULARY_SEARCH_CACHE:
+    None: an in-process LRU cache (LocalSearchCache)
+    a cache alias: the Django cache with that name (DjangoSearchCache),
+        which can be shared by all the workers (e.g. memcached, redis)
+"""
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from ..settings import get_var
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    """Returns the search cache (singleton), see module docstring."""
+    global _search_cache
+
+    if _search_cache is None:
+        with _search_cache_lock:
+            if _search_cache is None:
+                alias = get_var("SEARCH_CACHE")
+                if alias:
+                    _search_cache = DjangoSearchCache(alias)
+                else:
+                    _search_cache = LocalSearchCache(get_var("SEARCH_CACHE_SIZE"))
+
+    return _search_cache
+
+
+def normalise_pattern(pattern):
+    """Returns the form of <pattern> used in the cache keys:
+    lowercase, without leading, trailing or repeated spaces."""
+    return " ".join(pattern.split()).lower()
+
+
+class SearchCache:
+    """Abstract cache of search results, keyed by
+    (vocabulary prefix, normalised pattern).
+    Subclasses MUST override _get() and _set().
+    """
+
+    def __init__(self):
+        self._counters = Counter()
+
+    def get(self, prefix, pattern):
+        """Returns the cached terms for <pattern> in the vocabulary <prefix>.
+        None if they are not in the cache (or have expired).
+        """
+        ret = self._get(self.get_key(prefix, pattern))
+        self._counters[(prefix, "hits" if ret is not None else "misses")] += 1
+        return ret
+
+    def set(self, prefix, pattern, terms, ttl):
+        """Caches <terms> for <pattern> in the vocabulary <prefix>
+        during <ttl> seconds. Does nothing if <ttl> is 0 or None.
+        """
+        if ttl:
+            self._set(self.get_key(prefix, pattern), terms, ttl)
+
+    def get_stats(self):
+        """Returns the number of hits and misses of this process,
+        for each vocabulary prefix. e.g. {'viaf': {'hits': 3, 'misses': 1}}
+        """
+        ret = {}
+        for (prefix, counter), count in self._counters.items():
+            ret.setdefault(prefix, {"hits": 0, "misses": 0})[counter] = count
+        return ret
+
+    def get_key(self, prefix, pattern):
+        return (prefix, normalise_pattern(pattern))
+
+    def _get(self, key):
+        raise NotImplementedError()
+
+    def _set(self, key, terms, ttl):
+        raise NotImplementedError()
+
+
+class LocalSearchCache(SearchCache):
+    """In-process cache with a time to live for each entry
+    and a maximum number of entries (least recently used are evicted)."""
+
+    def __init__(self, max_size):
+        super().__init__()
+        self.max_size = max_size
+        # key: (expiry time, terms)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        ret = None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] < time.monotonic():
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    ret = entry[1]
+
+        return ret
+
+    def _set(self, key, terms, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, terms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoSearchCache(SearchCache):
+    """Cache stored in one of the caches configured in settings.CACHES.
+    Its size and eviction policy are those of that cache backend.
+    """
+
+    def __init__(self, alias):
+        super().__init__()
+        self.alias = alias
+
+    def get_key(self, prefix, pattern):
+        # safe for all backends (e.g. memcached doesn't allow spaces)
+        return "controlled_vocabulary:search:{}:{}".format(
+            prefix,
+            hashlib.md5(normalise_pattern(pattern).encode("utf-8")).hexdigest(),
+        )
+
+    def _get_cache(self):
+        from django.core.cache import caches
+
+        return caches[self.alias]
+
+    def _get(self, key):
+        return self._get_cache().get(key)
+
+    def _set(self, key, terms, ttl):
+        self._get_cache().set(key, terms, ttl)
@@ -0,0 +1,204 @@
+"""
+Registry of the vocabulary managers (see ControlledVocabularyConfig).
+
+The modules listed in settings.CONTROLLED_VOCABULARY_VOCABULARIES are only
+imported, and their managers instantiated, the first time a manager is
+requested. The prefix, class and metadata of the managers of each module
+are kept in a manifest (<DATA_ROOT>/vocabulary-managers.json), which is
+refreshed when the file of a module (or of one of the base classes of
+its managers) changes.
+"""
+import json
+import os
+import threading
+from collections.abc import MutableMapping
+from importlib import import_module, util
+
+from ..settings import get_var
+
+MANIFEST_FILENAME = "vocabulary-managers.json"
+
+# attributes of the managers kept in the manifest
+METADATA_FIELDS = ["prefix", "label", "base_url", "description", "concept"]
+
+
+class VocabularyRegistry(MutableMapping):
+    """Mapping from a vocabulary prefix to its manager (a unique instance).
+    e.g. registry["iso639-2"] imports iso639_2.py and returns an
+    instance of VocabularyISO639_2.
+
+    Managers can also be registered directly: registry[prefix] = manager
+    """
+
+    def __init__(self, module_paths):
+        # prefix: {"module": path, "class": name, "prefix": ..., ...}
+        self._entries = {}
+        # prefix: manager instance
+        self._managers = {}
+        self._lock = threading.RLock()
+
+        self._load_entries(module_paths)
+
+    def __getitem__(self, prefix):
+        ret = self._managers.get(prefix, None)
+        if ret is None:
+            entry = self._entries[prefix]
+            with self._lock:
+                ret = self._managers.get(prefix, None)
+                if ret is None:
+                    module = _import_vocabulary_module(entry["module"])
+                    ret = self._managers[prefix] = getattr(module, entry["class"])()
+
+        return ret
+
+    def __setitem__(self, prefix, manager):
+        with self._lock:
+            self._entries[prefix] = _get_metadata(manager)
+            self._managers[prefix] = manager
+
+    def __delitem__(self, prefix):
+        with self._lock:
+            del self._entries[prefix]
+            self._managers.pop(prefix, None)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_metadata(self):
+        """Returns the metadata of all the managers, without importing them.
+        e.g. [{"prefix": "iso639-2", "label": "ISO 639-2", ...}, ...]
+        """
+        return [
+            {field: entry[field] for field in METADATA_FIELDS}
+            for entry in self._entries.values()
+        ]
+
+    def get_module_path(self, prefix):
+        """Returns the import path of the module of the manager of <prefix>."""
+        return self._entries[prefix]["module"]
+
+    def is_loaded(self, prefix):
+        """Returns True if the manager of <prefix> has been instantiated."""
+        return prefix in self._managers
+
+    def _load_entries(self, module_paths):
+        manifest = _read_manifest()
+        changed = False
+
+        for path in module_paths:
+            module_entry = manifest.get(path, None)
+            if module_entry is None or _is_module_entry_stale(path, module_entry):
+                module_entry = manifest[path] = _get_module_entry(path)
+                changed = True
+
+            for entry in module_entry["managers"]:
+                self._entries[entry["prefix"]] = dict(entry, module=path)
+
+        if changed:
+            _write_manifest(manifest)
+
+
+def _get_metadata(manager):
+    ret = {field: getattr(manager, field) for field in METADATA_FIELDS}
+    ret["module"] = manager.__class__.__module__
+    ret["class"] = manager.__class__.__name__
+    return ret
+
+
+def _import_vocabulary_module(path):
+    try:
+        ret = import_module(path)
+    except ImportError:
+        raise (
+            ImportError(
+                "{} not found (referenced from {} in your settings)".format(
+                    path, "CONTROLLED_VOCABULARY_VOCABULARIES"
+                )
+            )
+        )
+
+    return ret
+
+
+def _get_module_entry(path):
+    """Imports the module at <path> and returns the entry of the manifest
+    for its managers."""
+    from .base import VocabularyBase
+    import inspect
+
+    module = _import_vocabulary_module(path)
+
+    managers = []
+    files = {}
+    for name in dir(module):
+        voc_class = getattr(module, name)
+        if (
+            inspect.isclass(voc_class)
+            and issubclass(voc_class, VocabularyBase)
+            and voc_class.prefix != "base"
+        ):
+            entry = {field: getattr(voc_class, field) for field in METADATA_FIELDS}
+            entry["class"] = name
+            managers.append(entry)
+
+            # the metadata can be inherited from other modules
+            for cls in voc_class.__mro__:
+                origin = getattr(import_module(cls.__module__), "__file__", None)
+                if origin:
+                    files[origin] = os.path.getmtime(origin)
+
+    files[module.__file__] = os.path.getmtime(module.__file__)
+
+    return {"files": files, "managers": managers}
+
+
+def _is_module_entry_stale(path, module_entry):
+    """Returns True if the files the entry was read from have changed
+    (or if the module is now loaded from another file)."""
+    try:
+        spec = util.find_spec(path)
+    except ImportError:
+        spec = None
+    if spec is None or spec.origin not in module_entry["files"]:
+        return True
+
+    for origin, mtime in module_entry["files"].items():
+        try:
+            if os.path.getmtime(origin) != mtime:
+                return True
+        except OSError:
+            return True
+
+    return False
+
+
+def _get_manifest_path():
+    return os.path.join(get_var("DATA_ROOT"), MANIFEST_FILENAME)
+
+
+def _read_manifest():
+    ret = {}
+
+    try:
+        with open(_get_manifest_path()) as fh:
+            ret = json.load(fh)
+    except (OSError, ValueError):
+        pass
+
+    return ret
+
+
+def _write_manifest(manifest):
+    path = _get_manifest_path()
+    # other processes may be writing it at the same time
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temp_path, "w") as fh:
+            json.dump(manifest, fh, indent=2, default=str)
+        os.replace(temp_path, path)
+    except OSError:
+        # read-only data root, the modules will be scanned at each start
+        pass
@@ -0,0 +1,70 @@
+import threading
+from collections import Counter
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key:
+    only the first thread calls the function,
+    the others wait for it and share its result (or exception).
+
+    Counts, for each key prefix (key[0]), the calls actually made
+    ('upstream') and the calls saved ('coalesced').
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def call(self, key, function, *args, **kwargs):
+        """Returns function(*args, **kwargs),
+        unless a call with the same key is already in flight,
+        in which case it waits and returns the result of that call.
+        """
+        with self._lock:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._counters[(key[0], "upstream" if leader else "coalesced")] += 1
+
+        if leader:
+            try:
+                call.result = function(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+
+        return call.result
+
+    def get_stats(self):
+        """Returns the number of upstream and coalesced calls
+        of this process, for each key prefix.
+        e.g. {'viaf': {'upstream': 2, 'coalesced': 5}}
+        """
+        ret = {}
+        with self._lock:
+            for (prefix, counter), count in self._counters.items():
+                ret.setdefault(prefix, {"upstream": 0, "coalesced": 0})[
+                    counter
+                ] = count
+        return ret
+
+
+# remote searches in flight, see VocabularyHTTP.search()
+search_flights = SingleFlight()
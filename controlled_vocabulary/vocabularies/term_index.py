@@ -0,0 +1,307 @@
+"""
+Compact binary index of the terms of a list vocabulary.
+
+The index is a single buffer which can be written to disk and memory-mapped
+read-only, so all the processes on a server share the same pages.
+
+Layout (native byte order, all integers are unsigned 32 bits):
+    header: magic, version, endianness mark, number of blobs
+    blob table: (offset, size) of each blob in the buffer
+    blobs:
+        TERM_OFFSETS, TERM_POOL:
+            termid, label, description of each term, in the original order
+        LABEL_OFFSETS, LABEL_POOL:
+            lowercase label of each term, in the original order
+        TERMID_OFFSETS, TERMID_POOL, TERMID_POSITIONS:
+            lowercase termids, sorted, and the position of their term
+        NGRAM_OFFSETS, NGRAM_POOL, POSTING_OFFSETS, POSTINGS:
+            ngrams of the lowercase labels, sorted,
+            and the sorted positions of the terms which contain them
+
+Strings are encoded in UTF-8 and sorted by their bytes.
+"""
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+# length of the substrings used to index the term labels
+NGRAM_LENGTH = 3
+
+MAGIC = b"CVTIDX"
+VERSION = 1
+ENDIAN_MARK = 0x01020304
+HEADER = "=6sHII"
+
+UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+(
+    TERM_OFFSETS,
+    TERM_POOL,
+    LABEL_OFFSETS,
+    LABEL_POOL,
+    TERMID_OFFSETS,
+    TERMID_POOL,
+    TERMID_POSITIONS,
+    NGRAM_OFFSETS,
+    NGRAM_POOL,
+    POSTING_OFFSETS,
+    POSTINGS,
+) = range(11)
+BLOB_COUNT = 11
+
+
+def get_ngrams(text, length=NGRAM_LENGTH):
+    """Returns the set of all substrings of <text> with the given length."""
+    return {text[i:i + length] for i in range(len(text) - length + 1)}
+
+
+def build_term_index(terms):
+    """Returns the binary index (bytes) of <terms>.
+    <terms>: an iterable of [termid, label] or [termid, label, description],
+    in the order they should be returned by a search.
+    """
+    blobs = [None] * BLOB_COUNT
+
+    term_offsets = array(UINT32, [0])
+    term_pool = bytearray()
+    labels = []
+    termids = []
+    ngrams = {}
+
+    for i, term in enumerate(terms):
+        desc = (term[2] if len(term) > 2 else "") or ""
+        for value in (term[0], term[1], desc):
+            term_pool += value.encode("utf-8")
+            term_offsets.append(len(term_pool))
+
+        label = term[1].lower()
+        labels.append(label.encode("utf-8"))
+        termids.append((term[0].lower().encode("utf-8"), i))
+        for ngram in get_ngrams(label):
+            ngrams.setdefault(ngram.encode("utf-8"), array(UINT32)).append(i)
+
+    blobs[TERM_OFFSETS] = term_offsets
+    blobs[TERM_POOL] = term_pool
+
+    blobs[LABEL_OFFSETS], blobs[LABEL_POOL] = _pack_strings(labels)
+
+    termids.sort()
+    blobs[TERMID_OFFSETS], blobs[TERMID_POOL] = _pack_strings(
+        [termid for termid, i in termids]
+    )
+    blobs[TERMID_POSITIONS] = array(UINT32, [i for termid, i in termids])
+
+    ngram_keys = sorted(ngrams)
+    blobs[NGRAM_OFFSETS], blobs[NGRAM_POOL] = _pack_strings(ngram_keys)
+    posting_offsets = array(UINT32, [0])
+    postings = array(UINT32)
+    for key in ngram_keys:
+        postings.extend(ngrams[key])
+        posting_offsets.append(len(postings))
+    blobs[POSTING_OFFSETS] = posting_offsets
+    blobs[POSTINGS] = postings
+
+    return _pack_blobs(blobs)
+
+
+def write_term_index(terms, path):
+    """Writes the binary index of <terms> to the file at <path>.
+    The file is replaced atomically, so processes which have mapped the
+    previous version can keep using it.
+    """
+    content = build_term_index(terms)
+
+    # other processes may be writing it at the same time,
+    # each one writes its own file then replaces the index
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temp_path, "wb") as fh:
+            fh.write(content)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return len(content)
+
+
+def _pack_strings(strings):
+    """Returns (offsets, pool) for a list of encoded strings."""
+    offsets = array(UINT32, [0])
+    pool = bytearray()
+    for string in strings:
+        pool += string
+        offsets.append(len(pool))
+    return offsets, pool
+
+
+def _pack_blobs(blobs):
+    table_size = struct.calcsize(HEADER) + struct.calcsize("=II") * len(blobs)
+
+    table = []
+    position = table_size
+    for blob in blobs:
+        size = len(blob) * getattr(blob, "itemsize", 1)
+        # keep the integer arrays aligned
+        position += -position % 4
+        table.append((position, size))
+        position += size
+
+    ret = bytearray(position)
+    struct.pack_into(HEADER, ret, 0, MAGIC, VERSION, ENDIAN_MARK, len(blobs))
+    offset = struct.calcsize(HEADER)
+    for blob, (position, size) in zip(blobs, table):
+        struct.pack_into("=II", ret, offset, position, size)
+        offset += struct.calcsize("=II")
+        ret[position:position + size] = bytes(blob)
+
+    return bytes(ret)
+
+
+class _StringTable:
+    """Read-only sequence of the (encoded) strings stored in a pool."""
+
+    def __init__(self, offsets, pool):
+        self.offsets = offsets
+        self.pool = pool
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.pool[self.offsets[i]:self.offsets[i + 1]])
+
+
+class TermIndex:
+    """Read-only sequence of terms backed by a binary index
+    (see build_term_index()).
+
+    terms[i] returns [termid, label, description].
+    """
+
+    def __init__(self, buffer):
+        """<buffer>: bytes or mmap"""
+        self._buffer = buffer
+        view = memoryview(buffer)
+
+        magic, version, mark, count = struct.unpack_from(HEADER, view)
+        if (magic, version, mark, count) != (
+            MAGIC, VERSION, ENDIAN_MARK, BLOB_COUNT
+        ):
+            raise ValueError("Unsupported term index format")
+
+        self._positions = []
+        blobs = []
+        offset = struct.calcsize(HEADER)
+        for i in range(count):
+            position, size = struct.unpack_from("=II", view, offset)
+            offset += struct.calcsize("=II")
+            self._positions.append(position)
+            blob = view[position:position + size]
+            if i not in (TERM_POOL, LABEL_POOL, TERMID_POOL, NGRAM_POOL):
+                blob = blob.cast(UINT32)
+            blobs.append(blob)
+
+        self._term_offsets = blobs[TERM_OFFSETS]
+        self._term_pool = blobs[TERM_POOL]
+        self._labels = _StringTable(blobs[LABEL_OFFSETS], blobs[LABEL_POOL])
+        self._termids = _StringTable(blobs[TERMID_OFFSETS], blobs[TERMID_POOL])
+        self._termid_positions = blobs[TERMID_POSITIONS]
+        self._ngrams = _StringTable(blobs[NGRAM_OFFSETS], blobs[NGRAM_POOL])
+        self._posting_offsets = blobs[POSTING_OFFSETS]
+        self._postings = blobs[POSTINGS]
+
+    @classmethod
+    def open(cls, path):
+        """Returns the TermIndex stored in the file at <path>,
+        memory-mapped read-only."""
+        with open(path, "rb") as fh:
+            buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self):
+        return (len(self._term_offsets) - 1) // 3
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+            if i < 0:
+                raise IndexError("term index out of range")
+
+        offsets = self._term_offsets
+        pool = self._term_pool
+        i *= 3
+        # raises IndexError if i is out of range
+        end = offsets[i + 3]
+        start, label, desc = offsets[i:i + 3]
+        return [
+            str(pool[start:label], "utf-8"),
+            str(pool[label:desc], "utf-8"),
+            str(pool[desc:end], "utf-8"),
+        ]
+
+    def get_candidate_positions(self, pattern):
+        """Returns the sorted positions of the terms which label may contain
+        <pattern> or which termid is equal to <pattern>.
+        <pattern> must be lowercase.
+        """
+        key = pattern.encode("utf-8")
+
+        if len(pattern) < NGRAM_LENGTH:
+            ret = set(self._find_label_positions(key))
+        else:
+            ret = self._get_ngram_positions(pattern)
+
+        termids = self._termids
+        i = bisect_left(termids, key)
+        while i < len(termids) and termids[i] == key:
+            ret.add(self._termid_positions[i])
+            i += 1
+
+        return sorted(ret)
+
+    def _get_ngram_positions(self, pattern):
+        postings = []
+        for ngram in get_ngrams(pattern):
+            ngram = ngram.encode("utf-8")
+            i = bisect_left(self._ngrams, ngram)
+            if i == len(self._ngrams) or self._ngrams[i] != ngram:
+                return set()
+            postings.append(
+                self._postings[
+                    self._posting_offsets[i]:self._posting_offsets[i + 1]
+                ]
+            )
+
+        # intersect, starting from the rarest ngram
+        postings = sorted(postings, key=len)
+        ret = set(postings[0])
+        for posting in postings[1:]:
+            ret.intersection_update(posting)
+            if not ret:
+                break
+
+        return ret
+
+    def _find_label_positions(self, key):
+        """Yields the positions of the terms which lowercase label
+        contains <key> (bytes)."""
+        offsets = self._labels.offsets
+        start = self._positions[LABEL_POOL]
+        end = start + offsets[len(offsets) - 1]
+
+        found = self._buffer.find(key, start, end)
+        while found != -1:
+            found -= start
+            i = bisect_right(offsets, found) - 1
+            if found + len(key) <= offsets[i + 1]:
+                yield i
+                found = self._buffer.find(key, start + offsets[i + 1], end)
+            else:
+                found = self._buffer.find(key, start + found + 1, end)